@@ -1,11 +1,13 @@
 import os
+import tempfile
 from os import path
 
 from flask import Flask, g
 from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache
 
-from database import SessionLocal, init_db
-from extensions import csrf, login_manager
+from database import PASSWORD_HASH_METHOD, SessionLocal, init_db
+from extensions import OrjsonProvider, csrf, login_manager
 from printer_service import printer_bp
 from app.blueprints.admin import admin_bp
 from app.blueprints.auth import auth_bp
@@ -18,6 +20,7 @@ from app.blueprints.deliveries import deliveries_bp
 from app.blueprints.academy import academy_bp
 from app.blueprints.pdf_printers import pdf_printers_bp
 from app.services.search_indexer import schedule_search_index
+from app.services.invoice_ocr_jobs import fail_stale_invoice_ocr
 from app.services.pricemind_sync_scheduler import schedule_pricemind_sync
 
 
@@ -31,6 +34,7 @@ def create_app():
         static_url_path="/static",
         template_folder=templates_root,
     )
+    app.json = OrjsonProvider(app)
     app.secret_key = os.environ.get("GSTROY_SECRET_KEY", "change-me")
     csrf.init_app(app)
     login_manager.init_app(app)
@@ -82,7 +86,25 @@ def create_app():
     except ValueError:
         ocr_large_zoom = 0.7
     app.config.setdefault("INVOICE_OCR_LARGE_PDF_ZOOM", ocr_large_zoom)
+    # Pages of one invoice are sent to the OCR API in parallel, spaced by a minimum interval
+    try:
+        ocr_concurrency = int(os.environ.get("INVOICE_OCR_CONCURRENCY", "4"))
+    except ValueError:
+        ocr_concurrency = 4
+    app.config.setdefault("INVOICE_OCR_CONCURRENCY", ocr_concurrency)
+    try:
+        ocr_min_interval = float(os.environ.get("INVOICE_OCR_MIN_INTERVAL", "0.5"))
+    except ValueError:
+        ocr_min_interval = 0.5
+    app.config.setdefault("INVOICE_OCR_MIN_INTERVAL", ocr_min_interval)
+    # Queued/processing invoices untouched this long are treated as lost with a previous process
+    try:
+        ocr_stale_minutes = int(os.environ.get("INVOICE_OCR_STALE_MINUTES", "30"))
+    except ValueError:
+        ocr_stale_minutes = 30
+    app.config.setdefault("INVOICE_OCR_STALE_MINUTES", ocr_stale_minutes)
     app.config.setdefault("SIGNATURE_MAX_BYTES", 200_000)
+    app.config.setdefault("PASSWORD_HASH_METHOD", PASSWORD_HASH_METHOD)
     app.config.setdefault(
         "NOMEN_API_URL",
         os.environ.get(
@@ -198,7 +220,17 @@ def create_app():
     else:
         es_force = es_force_raw.lower() in ("1", "true", "yes", "on")
     app.config.setdefault("ELASTICSEARCH_FORCE_REINDEX", es_force)
+    app.config.setdefault(
+        "JINJA_BYTECODE_CACHE_DIR",
+        os.environ.get("JINJA_BYTECODE_CACHE_DIR", path.join(tempfile.gettempdir(), "gstroy-jinja")),
+    )
+    # Compiled templates are shared between worker processes and restarts; an empty value disables it.
+    bytecode_dir = app.config["JINJA_BYTECODE_CACHE_DIR"]
+    if bytecode_dir:
+        os.makedirs(bytecode_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
     init_db()
+    fail_stale_invoice_ocr(app)
     schedule_search_index(app)
     schedule_pricemind_sync(app)
 
@@ -1,18 +1,23 @@
 import os
 import re
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime
 
 from flask import Blueprint, flash, g, redirect, render_template, request, url_for, current_app, jsonify
-from sqlalchemy import func, or_
-from sqlalchemy.orm import joinedload, load_only
-from werkzeug.security import generate_password_hash
+from sqlalchemy import delete, exists, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only, selectinload
 from werkzeug.utils import secure_filename
 
 from app.services.sync_service import ProductSyncService
 from app.services.feed_sync_service import ProductFeedSyncService
+from app.services.order_tasks import invalidate_service_point_candidates
 from app.services.pricemind_sync_service import PricemindSyncService
 from app.services.search_service import ProductSearchService
 from helpers import (
+    BLOCKING_EXECUTOR,
+    hash_password,
     hierarchical_address,
     parse_bool,
     parse_float,
@@ -20,7 +25,7 @@ from helpers import (
     slugify,
     unique_slug,
 )
-from .catalog_sync import ensure_catalog_entries_for_products
+from .catalog_sync import bump_catalog_generation, ensure_catalog_entries_for_products
 from models import (
     AccessWindow,
     AcademyCategory,
@@ -41,7 +46,7 @@ from models import (
     Printer,
     Location,
 )
-from printer_service import get_printer_status
+from printer_service import LABEL_SERVER_STATUS_TIMEOUT, get_printer_status
 
 # Създаваме Blueprint-а
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin", template_folder="templates")
@@ -89,21 +94,44 @@ def _load_category_tree(session):
     )
 
 
-def _refresh_category_tree(node):
+def _refresh_category_node(node):
     slug_value = node.slug or slugify(node.name) or "category"
     parent_address = node.parent.address if node.parent else None
     node.slug = slug_value
     node.address = hierarchical_address(slug_value, parent_address)
     node.level = (node.parent.level if node.parent else 0) + 1
     for child in node.children:
-        _refresh_category_tree(child)
+        _refresh_category_node(child)
 
 
-def _collect_category_ids(category):
-    ids = [category.id]
-    for child in category.children:
-        ids.extend(_collect_category_ids(child))
-    return ids
+def _refresh_category_tree(session, node):
+    old_address = node.address
+    old_level = node.level
+    if not old_address or old_level is None:
+        # Legacy rows without an address cannot be matched by prefix.
+        _refresh_category_node(node)
+        return
+    slug_value = node.slug or slugify(node.name) or "category"
+    node.slug = slug_value
+    node.address = hierarchical_address(slug_value, node.parent.address if node.parent else None)
+    node.level = (node.parent.level if node.parent else 0) + 1
+    if node.address == old_address and node.level == old_level:
+        return
+    session.execute(
+        update(Category)
+        .where(Category.address.startswith(f"{old_address}/", autoescape=True))
+        .values(
+            address=node.address + func.substr(Category.address, len(old_address) + 1),
+            level=Category.level + (node.level - old_level),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _category_subtree_ids(category_id):
+    subtree = select(Category.id).where(Category.id == category_id).cte(recursive=True)
+    subtree = subtree.union_all(select(Category.id).where(Category.parent_id == subtree.c.id))
+    return select(subtree.c.id)
 
 
 DAYS_OF_WEEK = [
@@ -229,6 +257,12 @@ def _apply_location_form(location, form):
         location.parent = None
 
 
+def _warehouse_exists(session, warehouse_id):
+    if not warehouse_id:
+        return False
+    return session.query(exists().where(Warehouse.id == warehouse_id)).scalar()
+
+
 def _set_default_printer(session, printer):
     if not printer or not printer.is_default:
         return
@@ -865,6 +899,7 @@ def categories_panel():
             )
             session.add(category)
             session.commit()
+            bump_catalog_generation()
             flash("Category added successfully.", "success")
         return redirect(url_for(".categories_panel"))
 
@@ -876,7 +911,7 @@ def categories_panel():
 
     categories = (
         session.query(Category)
-        .options(joinedload(Category.parent))
+        .options(selectinload(Category.parent))
         .order_by(Category.address)
         .offset((page - 1) * per_page)
         .limit(per_page)
@@ -960,8 +995,9 @@ def update_category(category_id):
     category.meta_description = meta_description
     category.canonical_url = canonical_url
     category.image_url = image_url
-    _refresh_category_tree(category)
+    _refresh_category_tree(session, category)
     session.commit()
+    bump_catalog_generation()
     flash("Category updated successfully.", "success")
     return redirect(url_for(".categories_panel"))
 
@@ -970,12 +1006,11 @@ def update_category(category_id):
 def delete_category(category_id):
     require_admin()
     session = g.db
-    category = session.get(Category, category_id)
-    if not category:
+    if not session.query(exists().where(Category.id == category_id)).scalar():
         return render_template("404.html"), 404
-    category_ids = _collect_category_ids(category)
+    subtree_ids = _category_subtree_ids(category_id)
     product_count = (
-        session.query(func.count(Product.id)).filter(Product.category_id.in_(category_ids)).scalar()
+        session.query(func.count(Product.id)).filter(Product.category_id.in_(subtree_ids)).scalar()
         or 0
     )
     if product_count:
@@ -985,8 +1020,13 @@ def delete_category(category_id):
         )
         return redirect(url_for(".categories_panel", edit_id=category_id))
 
-    session.delete(category)
+    session.execute(
+        delete(Category)
+        .where(Category.id.in_(subtree_ids))
+        .execution_options(synchronize_session=False)
+    )
     session.commit()
+    bump_catalog_generation()
     flash("Категорията и нейният клон бяха изтрити.", "success")
     return redirect(url_for(".categories_panel"))
 
@@ -1059,17 +1099,47 @@ def brands_panel():
 def users_panel():
     require_admin()
     session = g.db
+    page = max(request.args.get("page", type=int, default=1), 1)
+    per_page = 50
+    search = (request.args.get("q") or "").strip()
+    total_users = session.query(func.count(User.id)).scalar() or 0
+    users_query = session.query(User)
+    matched_users = total_users
+    if search:
+        like_search = f"%{search}%"
+        users_query = users_query.filter(
+            or_(User.full_name.ilike(like_search), User.username.ilike(like_search))
+        )
+        matched_users = users_query.with_entities(func.count(User.id)).scalar() or 0
+    total_pages = max((matched_users + per_page - 1) // per_page, 1)
+    page = min(page, total_pages)
+
     users = (
-        session.query(User)
-        .options(joinedload(User.service_points))
+        users_query
+        .options(selectinload(User.service_points).load_only(ServicePoint.id, ServicePoint.code))
         .order_by(User.full_name)
+        .offset((page - 1) * per_page)
+        .limit(per_page)
         .all()
     )
+    admins_count = (
+        session.query(func.count(User.id)).filter(User.is_admin.is_(True)).scalar() or 0
+    )
     stats = {
         "products_count": session.query(func.count(Product.id)).scalar() or 0,
-        "users_count": session.query(func.count(User.id)).scalar() or 0,
+        "users_count": total_users,
     }
-    return render_template("admin_users.html", users=users, stats=stats)
+    return render_template(
+        "admin_users.html",
+        users=users,
+        total_users=total_users,
+        admins_count=admins_count,
+        search=search,
+        page=page,
+        per_page=per_page,
+        total_pages=total_pages,
+        stats=stats,
+    )
 
 
 @admin_bp.route("/users/new", methods=["GET", "POST"])
@@ -1088,7 +1158,7 @@ def user_create():
             return redirect(url_for(".user_create"))
         user = User(
             username=username,
-            password_hash=generate_password_hash(password),
+            password_hash=hash_password(password),
             is_admin=parse_bool(request.form.get("is_admin")),
             can_assign_orders=parse_bool(request.form.get("can_assign_orders")),
             can_prepare_orders=parse_bool(request.form.get("can_prepare_orders")),
@@ -1097,6 +1167,7 @@ def user_create():
         _apply_user_form_values(user, request.form, session)
         session.add(user)
         session.commit()
+        invalidate_service_point_candidates()
         flash("Потребителят е създаден.", "success")
         return redirect(url_for(".users_panel"))
     context = _user_form_options(session)
@@ -1126,9 +1197,10 @@ def update_user(user_id):
     user.can_prepare_orders = parse_bool(request.form.get("can_prepare_orders"))
     user.can_view_competitor_prices = parse_bool(request.form.get("can_view_competitor_prices"))
     if request.form.get("password"):
-        user.password_hash = generate_password_hash(request.form.get("password"))
+        user.password_hash = hash_password(request.form.get("password"))
     _apply_user_form_values(user, request.form, session)
     session.commit()
+    invalidate_service_point_candidates()
     flash("Потребителят е обновен.", "success")
     return redirect(url_for(".user_detail", user_id=user_id))
 
@@ -1144,7 +1216,7 @@ def reset_user_password(user_id):
     if not new_password:
         flash("Моля въведете нова парола.", "warning")
         return redirect(url_for(".users_panel"))
-    user.password_hash = generate_password_hash(new_password)
+    user.password_hash = hash_password(new_password)
     session.commit()
     flash(f"Паролата за {user.full_name} беше ресетната.", "success")
     return redirect(url_for(".users_panel"))
@@ -1290,10 +1362,8 @@ def create_location(warehouse_id):
 def printers_panel():
     require_admin()
     session = g.db
-    warehouses = session.query(Warehouse).order_by(Warehouse.name).all()
     if request.method == "POST":
         warehouse_id = request.form.get("warehouse_id", type=int)
-        warehouse = session.get(Warehouse, warehouse_id) if warehouse_id else None
         name = (request.form.get("name") or "").strip()
         ip_address = (request.form.get("ip_address") or "").strip()
         server_url = (request.form.get("server_url") or "").strip() or None
@@ -1301,19 +1371,11 @@ def printers_panel():
         description = (request.form.get("description") or "").strip() or None
         is_active = parse_bool(request.form.get("is_active"))
         is_default = parse_bool(request.form.get("is_default"))
-        if not warehouse or not ip_address:
+        if not ip_address or not _warehouse_exists(session, warehouse_id):
             flash("Изберете склад и въведете IP на принтера.", "warning")
             return redirect(url_for(".printers_panel"))
-        # Check for duplicate (warehouse_id, ip_address)
-        existing = session.query(Printer).filter(
-            Printer.warehouse_id == warehouse.id,
-            Printer.ip_address == ip_address
-        ).first()
-        if existing:
-            flash("В този склад вече има принтер с този IP адрес!", "danger")
-            return redirect(url_for(".printers_panel"))
         printer = Printer(
-            warehouse_id=warehouse.id,
+            warehouse_id=warehouse_id,
             name=name or None,
             ip_address=ip_address,
             server_url=server_url,
@@ -1323,28 +1385,39 @@ def printers_panel():
             is_default=is_default,
         )
         session.add(printer)
-        session.flush()
-        _set_default_printer(session, printer)
         try:
+            # uq_warehouse_printer_ip rejects duplicate IPs within a warehouse.
+            session.flush()
+            _set_default_printer(session, printer)
             session.commit()
             flash("Принтерът е добавен.", "success")
+        except IntegrityError:
+            session.rollback()
+            flash("В този склад вече има принтер с този IP адрес!", "danger")
         except Exception as exc:
             session.rollback()
             flash(f"Грешка при запис: {str(exc)}", "danger")
         return redirect(url_for(".printers_panel"))
 
+    warehouses = session.query(Warehouse).order_by(Warehouse.name).all()
     printers = (
         session.query(Printer)
-        .options(joinedload(Printer.warehouse))
+        .options(selectinload(Printer.warehouse))
         .order_by(Printer.warehouse_id, Printer.name, Printer.ip_address)
         .all()
     )
+    status_futures = {
+        printer.id: BLOCKING_EXECUTOR.submit(get_printer_status, printer) for printer in printers
+    }
+    deadline = time.monotonic() + LABEL_SERVER_STATUS_TIMEOUT + 1
     printer_statuses = {}
-    for printer in printers:
+    for printer_id, future in status_futures.items():
         try:
-            printer_statuses[printer.id] = get_printer_status(printer)
+            printer_statuses[printer_id] = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeoutError:
+            printer_statuses[printer_id] = {"online": False, "error": "Timeout"}
         except Exception as exc:
-            printer_statuses[printer.id] = {"online": False, "error": str(exc)}
+            printer_statuses[printer_id] = {"online": False, "error": str(exc)}
     return render_template(
         "admin_printers.html",
         printers=printers,
@@ -1360,24 +1433,13 @@ def printer_detail(printer_id):
     printer = session.get(Printer, printer_id)
     if not printer:
         return render_template("404.html"), 404
-    warehouses = session.query(Warehouse).order_by(Warehouse.name).all()
     if request.method == "POST":
         warehouse_id = request.form.get("warehouse_id", type=int)
-        warehouse = session.get(Warehouse, warehouse_id) if warehouse_id else None
-        if not warehouse:
+        if not _warehouse_exists(session, warehouse_id):
             flash("Изберете валиден склад.", "warning")
             return redirect(url_for(".printer_detail", printer_id=printer_id))
         new_ip = (request.form.get("ip_address") or "").strip()
-        # Check for duplicate (warehouse_id, ip_address) except self
-        existing = session.query(Printer).filter(
-            Printer.warehouse_id == warehouse.id,
-            Printer.ip_address == new_ip,
-            Printer.id != printer.id
-        ).first()
-        if existing:
-            flash("В този склад вече има принтер с този IP адрес!", "danger")
-            return redirect(url_for(".printer_detail", printer_id=printer_id))
-        printer.warehouse = warehouse
+        printer.warehouse_id = warehouse_id
         printer.name = (request.form.get("name") or "").strip() or None
         printer.ip_address = new_ip
         printer.server_url = (request.form.get("server_url") or "").strip() or None
@@ -1385,15 +1447,20 @@ def printer_detail(printer_id):
         printer.description = (request.form.get("description") or "").strip() or None
         printer.is_active = parse_bool(request.form.get("is_active"))
         printer.is_default = parse_bool(request.form.get("is_default"))
-        session.flush()
-        _set_default_printer(session, printer)
         try:
+            session.flush()
+            _set_default_printer(session, printer)
             session.commit()
             flash("Принтерът е обновен.", "success")
+        except IntegrityError:
+            session.rollback()
+            flash("В този склад вече има принтер с този IP адрес!", "danger")
+            return redirect(url_for(".printer_detail", printer_id=printer_id))
         except Exception as exc:
             session.rollback()
             flash(f"Грешка при запис: {str(exc)}", "danger")
         return redirect(url_for(".printers_panel"))
+    warehouses = session.query(Warehouse).order_by(Warehouse.name).all()
     return render_template("admin_printer_detail.html", printer=printer, warehouses=warehouses)
 
 
@@ -1511,6 +1578,40 @@ def erp_panel():
     return render_template("admin_erp.html", services=services)
 
 
+# Snapshots of a finished Pricemind sync are never modified, so the preview
+# rows can be cached by sync log id; a new sync simply produces a new key.
+_pricemind_rows_cache: dict[int, list[dict]] = {}
+# Filtered snapshot counts for the latest sync, keyed by (sku, competitor, unmatched).
+_pricemind_snapshot_totals: dict = {"sync_log_id": None, "totals": {}}
+
+
+def _pricemind_rows(session, sync_log_id, limit=30):
+    rows = _pricemind_rows_cache.get(sync_log_id)
+    if rows is not None:
+        return rows
+    latest_snapshots = (
+        session.query(PricemindSnapshot)
+        .filter(PricemindSnapshot.sync_log_id == sync_log_id)
+        .order_by(PricemindSnapshot.id.desc())
+        .limit(limit)
+        .all()
+    )
+    rows = [
+        {
+            "sku": snap.sku,
+            "title": snap.title,
+            "my_price": snap.my_price,
+            "lowest_price": snap.lowest_price,
+            "lowest_competitor": snap.lowest_price_competitor,
+            "is_matched": bool(snap.product_id),
+        }
+        for snap in latest_snapshots
+    ]
+    _pricemind_rows_cache.clear()
+    _pricemind_rows_cache[sync_log_id] = rows
+    return rows
+
+
 @admin_bp.route("/sync-center")
 def sync_center():
     require_admin()
@@ -1527,24 +1628,31 @@ def sync_center():
     last_status_badge = _status_badge(last_status)
 
     history = (
-        session.query(SyncLog)
+        session.query(
+            SyncLog.id,
+            SyncLog.started_at,
+            SyncLog.completed_at,
+            func.coalesce(SyncLog.total_fetched, 0).label("total_fetched"),
+            func.coalesce(SyncLog.created_count, 0).label("created_count"),
+            func.coalesce(SyncLog.updated_count, 0).label("updated_count"),
+            SyncLog.status,
+        )
         .order_by(SyncLog.started_at.desc())
         .limit(20)
         .all()
     )
-    history_rows = []
-    for entry in history:
-        history_rows.append(
-            {
-                "id": entry.id,
-                "started_at": entry.started_at,
-                "duration": _format_duration(entry.started_at, entry.completed_at),
-                "total_fetched": entry.total_fetched or 0,
-                "created_count": entry.created_count or 0,
-                "updated_count": entry.updated_count or 0,
-                "status": entry.status,
-            }
-        )
+    history_rows = [
+        {
+            "id": row.id,
+            "started_at": row.started_at,
+            "duration": _format_duration(row.started_at, row.completed_at),
+            "total_fetched": row.total_fetched,
+            "created_count": row.created_count,
+            "updated_count": row.updated_count,
+            "status": row.status,
+        }
+        for row in history
+    ]
 
     pricemind_last = (
         session.query(PricemindSyncLog)
@@ -1553,24 +1661,7 @@ def sync_center():
     )
     pricemind_rows = []
     if pricemind_last and pricemind_last.status == "SUCCESS":
-        latest_snapshots = (
-            session.query(PricemindSnapshot)
-            .filter(PricemindSnapshot.sync_log_id == pricemind_last.id)
-            .order_by(PricemindSnapshot.id.desc())
-            .limit(30)
-            .all()
-        )
-        for snap in latest_snapshots:
-            pricemind_rows.append(
-                {
-                    "sku": snap.sku,
-                    "title": snap.title,
-                    "my_price": snap.my_price,
-                    "lowest_price": snap.lowest_price,
-                    "lowest_competitor": snap.lowest_price_competitor,
-                    "is_matched": bool(snap.product_id),
-                }
-            )
+        pricemind_rows = _pricemind_rows(session, pricemind_last.id)
 
     return render_template(
         "admin/sync_center.html",
@@ -1599,6 +1690,14 @@ def trigger_sync():
     single_id = (current_app.config.get("NOMEN_API_SINGLE_ID") or "").strip()
     if single_id:
         deactivate_missing = False
+    feed_enabled = current_app.config.get("FB_FEED_SYNC_ENABLED", True)
+    # The feed download overlaps the ERP sync; its updates still run afterwards
+    # because they read the products the ERP sync creates.
+    feed_rows = None
+    if feed_enabled:
+        feed_rows = ProductFeedSyncService.prefetch_rows(
+            current_app._get_current_object(), BLOCKING_EXECUTOR
+        )
     nomen_log = service.run_sync(
         triggered_by=triggered_by,
         apply_to_catalog=apply_to_catalog,
@@ -1606,10 +1705,11 @@ def trigger_sync():
     )
 
     feed_log = None
-    feed_enabled = current_app.config.get("FB_FEED_SYNC_ENABLED", True)
     if feed_enabled:
         feed_service = ProductFeedSyncService(session)
-        feed_log = feed_service.run_sync(triggered_by=f"{triggered_by} (FB Feed)")
+        feed_log = feed_service.run_sync(
+            triggered_by=f"{triggered_by} (FB Feed)", rows_future=feed_rows
+        )
 
     messages = []
     overall_success = True
@@ -1672,7 +1772,9 @@ def pricemind_snapshots():
     sku_query = (request.args.get("sku") or "").strip()
     competitor_query = (request.args.get("competitor") or "").strip()
     unmatched_only = parse_bool(request.args.get("unmatched"))
-    page = request.args.get("page", 1, type=int)
+    page = max(request.args.get("page", 1, type=int), 1)
+    before_id = request.args.get("before", type=int)
+    after_id = request.args.get("after", type=int)
     per_page = 50
 
     last_log = (
@@ -1693,25 +1795,66 @@ def pricemind_snapshots():
             unmatched_only=unmatched_only,
         )
 
-    query = session.query(PricemindSnapshot).filter(
-        PricemindSnapshot.sync_log_id == last_log.id
-    )
+    filters = [PricemindSnapshot.sync_log_id == last_log.id]
     if sku_query:
-        query = query.filter(PricemindSnapshot.sku.ilike(f"%{sku_query}%"))
+        filters.append(PricemindSnapshot.sku.ilike(f"%{sku_query}%"))
     if unmatched_only:
-        query = query.filter(PricemindSnapshot.product_id.is_(None))
+        filters.append(PricemindSnapshot.product_id.is_(None))
     if competitor_query:
-        query = query.join(PricemindCompetitorPrice).filter(
-            PricemindCompetitorPrice.competitor.ilike(f"%{competitor_query}%")
+        filters.append(
+            exists()
+            .where(PricemindCompetitorPrice.snapshot_id == PricemindSnapshot.id)
+            .where(PricemindCompetitorPrice.competitor.ilike(f"%{competitor_query}%"))
         )
-
-    total = query.order_by(None).count()
-    rows = (
-        query.order_by(PricemindSnapshot.id.desc())
-        .offset((page - 1) * per_page)
-        .limit(per_page)
-        .all()
+    # The listing never touches relationships; skip raw_payload and the other
+    # wide text columns instead of eager-loading anything.
+    query = (
+        session.query(PricemindSnapshot)
+        .options(
+            load_only(
+                PricemindSnapshot.id,
+                PricemindSnapshot.sku,
+                PricemindSnapshot.title,
+                PricemindSnapshot.my_price,
+                PricemindSnapshot.lowest_price,
+                PricemindSnapshot.lowest_price_competitor,
+                PricemindSnapshot.product_id,
+            )
+        )
+        .filter(*filters)
     )
+
+    totals_cache = _pricemind_snapshot_totals
+    if totals_cache["sync_log_id"] != last_log.id or len(totals_cache["totals"]) >= 256:
+        totals_cache["sync_log_id"] = last_log.id
+        totals_cache["totals"] = {}
+    total_key = (sku_query, competitor_query, unmatched_only)
+    total = totals_cache["totals"].get(total_key)
+    if total is None:
+        total = session.query(func.count(PricemindSnapshot.id)).filter(*filters).scalar()
+        totals_cache["totals"][total_key] = total
+    if before_id:
+        rows = (
+            query.filter(PricemindSnapshot.id < before_id)
+            .order_by(PricemindSnapshot.id.desc())
+            .limit(per_page)
+            .all()
+        )
+    elif after_id:
+        rows = (
+            query.filter(PricemindSnapshot.id > after_id)
+            .order_by(PricemindSnapshot.id.asc())
+            .limit(per_page)
+            .all()
+        )
+        rows.reverse()
+    else:
+        rows = (
+            query.order_by(PricemindSnapshot.id.desc())
+            .offset((page - 1) * per_page)
+            .limit(per_page)
+            .all()
+        )
     return render_template(
         "admin/pricemind_snapshots.html",
         rows=rows,
@@ -1,4 +1,13 @@
-from flask import Blueprint, flash, g, redirect, render_template, request, url_for
+from flask import (
+    Blueprint,
+    flash,
+    g,
+    has_request_context,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
 from flask_login import current_user, login_required, login_user, logout_user
 from sqlalchemy import func
 from werkzeug.security import check_password_hash
@@ -15,6 +24,9 @@ auth_bp = Blueprint("auth", __name__)
 def load_user(user_id: str | int | None):
     if not user_id:
         return None
+    # Flask-Login memoizes the result for the request, so this runs once.
+    if has_request_context() and "db" in g:
+        return g.db.get(User, int(user_id))
     session = SessionLocal()
     try:
         return session.get(User, int(user_id))
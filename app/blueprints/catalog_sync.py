@@ -1,20 +1,36 @@
 from __future__ import annotations
 
 import re
+from collections.abc import Iterable
 
 from sqlalchemy import exc, func, or_
 
-from helpers import hierarchical_address, normalize_name, slugify, unique_slug
+from helpers import hierarchical_address, normalize_name, slugify
 from models import Brand, Category, Product
 
 
+_catalog_generation = 0
+
+
+def catalog_generation() -> int:
+    return _catalog_generation
+
+
+def bump_catalog_generation():
+    """Invalidate per-process caches derived from the product catalog."""
+    global _catalog_generation
+    _catalog_generation += 1
+
+
+_SPLIT_RE = re.compile(r"[,/]")
+_DASHES = frozenset(("—", "-"))
+
+
 def _cleanup_text(value: str | None) -> str | None:
     if value is None:
         return None
     text = str(value).strip()
-    if not text:
-        return None
-    if text in {"—", "-"}:
+    if not text or text in _DASHES:
         return None
     return text
 
@@ -23,8 +39,7 @@ def _delimiter_split(value: str | None) -> list[str]:
     cleaned = _cleanup_text(value)
     if not cleaned:
         return []
-    parts = [part.strip() for part in re.split(r"[,/]", cleaned)]
-    return [part for part in parts if part]
+    return [part for part in map(str.strip, _SPLIT_RE.split(cleaned)) if part]
 
 
 def extract_category_levels(payload: dict) -> list[str]:
@@ -53,14 +68,36 @@ def extract_category_levels(payload: dict) -> list[str]:
     return levels
 
 
+def _next_free_slug(taken: set[str], base_slug: str) -> str:
+    slug_candidate = base_slug
+    counter = 1
+    while slug_candidate in taken:
+        counter += 1
+        slug_candidate = f"{base_slug}-{counter}"
+    taken.add(slug_candidate)
+    return slug_candidate
+
+
 class BrandRegistry:
-    def __init__(self, session):
+    """
+    Resolve brand names to Brand rows, creating missing ones.
+
+    With ``deferred=True`` new brands are only added to the session and are
+    inserted together by ``flush_pending()`` instead of one flush per brand.
+    """
+
+    def __init__(self, session, deferred: bool = False):
         self.session = session
+        self.deferred = deferred
         self.cache: dict[str, Brand] = {}
+        self.slug_cache: set[str] = set()
+        self.pending: list[Brand] = []
         self._populate()
 
     def _populate(self):
         for brand in self.session.query(Brand).all():
+            if brand.slug:
+                self.slug_cache.add(brand.slug)
             norm = normalize_name(brand.name)
             if norm:
                 self.cache.setdefault(norm, brand)
@@ -77,9 +114,13 @@ class BrandRegistry:
             return cached
 
         slug_base = slugify(cleaned) or "brand"
-        slug_value = unique_slug(self.session, Brand, slug_base)
+        slug_value = _next_free_slug(self.slug_cache, slug_base)
         brand = Brand(name=cleaned, slug=slug_value)
         self.session.add(brand)
+        if self.deferred:
+            self.pending.append(brand)
+            self.cache[norm] = brand
+            return brand
         try:
             self.session.flush()
         except exc.IntegrityError:
@@ -94,32 +135,66 @@ class BrandRegistry:
         self.cache[norm] = brand
         return brand
 
+    def flush_pending(self):
+        if not self.pending:
+            return
+        self.session.flush()
+        self.pending.clear()
+
+    def ensure_many(self, raw_names: Iterable[str | None]) -> dict[str, Brand]:
+        """Resolve several names, inserting all missing brands in one flush."""
+        deferred, self.deferred = self.deferred, True
+        try:
+            resolved = {}
+            for raw_name in raw_names:
+                brand = self.ensure(raw_name)
+                if brand:
+                    resolved[raw_name] = brand
+            self.flush_pending()
+        finally:
+            self.deferred = deferred
+        return resolved
+
 
 class CategoryRegistry:
-    def __init__(self, session):
+    """
+    Resolve category level paths to Category rows, creating missing ones.
+
+    Supports the same ``deferred`` mode as ``BrandRegistry``; pending parents
+    are linked through the relationship so the flush orders the inserts.
+    """
+
+    def __init__(self, session, deferred: bool = False):
         self.session = session
-        self.cache: dict[tuple[int | None, str], Category] = {}
+        self.deferred = deferred
+        self.cache: dict[tuple[Category | None, str], Category] = {}
+        self.slug_cache: set[str] = set()
+        self.pending: list[Category] = []
         self._populate()
 
-    def _cache_key(self, parent_id: int | None, name: str) -> tuple[int | None, str]:
-        return parent_id, normalize_name(name)
+    def _cache_key(self, parent: Category | None, name: str) -> tuple[Category | None, str]:
+        return parent, normalize_name(name)
 
     def _populate(self):
-        for category in self.session.query(Category).all():
+        categories = self.session.query(Category).all()
+        by_id = {category.id: category for category in categories}
+        for category in categories:
+            if category.slug:
+                self.slug_cache.add(category.slug)
             norm = normalize_name(category.name)
             if not norm:
                 continue
-            key = self._cache_key(category.parent_id, category.name)
+            key = self._cache_key(by_id.get(category.parent_id), category.name)
             self.cache.setdefault(key, category)
 
     def ensure_for_levels(self, levels: list[str]) -> Category | None:
         parent: Category | None = None
         for raw_level in levels:
-            key = self._cache_key(parent.id if parent else None, raw_level)
+            key = self._cache_key(parent, raw_level)
             category = self.cache.get(key)
             if not category:
                 slug_base = slugify(raw_level) or "category"
-                slug_value = unique_slug(self.session, Category, slug_base)
+                slug_value = _next_free_slug(self.slug_cache, slug_base)
                 parent_address = parent.address if parent else None
                 category = Category(
                     name=raw_level,
@@ -129,16 +204,42 @@ class CategoryRegistry:
                     address=hierarchical_address(slug_value, parent_address),
                 )
                 self.session.add(category)
-                self.session.flush()
+                if self.deferred:
+                    self.pending.append(category)
+                else:
+                    self.session.flush()
                 self.cache[key] = category
             parent = category
         return parent
 
+    def flush_pending(self):
+        if not self.pending:
+            return
+        self.session.flush()
+        self.pending.clear()
+
+    def ensure_many(
+        self, level_paths: Iterable[tuple[str, ...]]
+    ) -> dict[tuple[str, ...], Category]:
+        """Resolve several level paths, inserting all missing categories in one flush."""
+        deferred, self.deferred = self.deferred, True
+        try:
+            resolved = {}
+            for levels in level_paths:
+                category = self.ensure_for_levels(list(levels))
+                if category:
+                    resolved[levels] = category
+            self.flush_pending()
+        finally:
+            self.deferred = deferred
+        return resolved
+
 
 def ensure_catalog_entries_for_products(session, products=None):
     """
     Ensure there are Brand and Category records for the provided products.
     If no list is supplied, only products missing brand_id or category_id are processed.
+    Missing brands and categories are created in one flush per table.
     """
     registry_brand = BrandRegistry(session)
     registry_category = CategoryRegistry(session)
@@ -148,15 +249,11 @@ def ensure_catalog_entries_for_products(session, products=None):
             .filter(or_(Product.brand_id.is_(None), Product.category_id.is_(None)))
             .all()
         )
-    updated = False
+    brand_names = dict.fromkeys(
+        product.brand for product in products if product.brand and not product.brand_id
+    )
+    level_paths = {}
     for product in products:
-        product_updated = False
-        if product.brand and not product.brand_id:
-            brand = registry_brand.ensure(product.brand)
-            if brand:
-                product.brand_id = brand.id
-                product.brand = brand.name
-                product_updated = True
         if not product.category_id:
             payload = {
                 "primary_group": product.primary_group,
@@ -167,13 +264,23 @@ def ensure_catalog_entries_for_products(session, products=None):
                 "subgroup": product.subgroup,
                 "quaternary_group": product.quaternary_group,
             }
-            category = registry_category.ensure_for_levels(extract_category_levels(payload))
-            if category:
-                product.category_id = category.id
-                if not product.category:
-                    product.category = category.full_address
-                product_updated = True
-        if product_updated:
+            level_paths[product] = tuple(extract_category_levels(payload))
+    brands = registry_brand.ensure_many(brand_names)
+    categories = registry_category.ensure_many(dict.fromkeys(level_paths.values()))
+
+    updated = False
+    for product in products:
+        brand = brands.get(product.brand) if not product.brand_id else None
+        if brand:
+            product.brand_id = brand.id
+            product.brand = brand.name
+            updated = True
+        category = categories.get(level_paths.get(product))
+        if category:
+            product.category_id = category.id
+            if not product.category:
+                product.category = category.full_address
             updated = True
     if updated:
         session.commit()
+        bump_catalog_generation()
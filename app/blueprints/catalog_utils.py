@@ -5,20 +5,14 @@ from .catalog_sync import extract_category_levels
 from gstroy_constants import PRODUCT_CSV_FIELDS
 
 
+_HEADER_TRANSLATION = str.maketrans({'"': None, "-": "_", "/": "_"})
+# Two spaces collapse into one underscore, matching the old replace("  ", " ").replace(" ", "_") chain.
+_HEADER_SPACES_RE = re.compile(" {1,2}")
+
+
 def normalize_header(name: str) -> str:
-    return (
-        (name or "")
-        .strip()
-        .lower()
-        .replace("ў??", "")
-        .replace("ў??", "")
-        .replace("ў??", "")
-        .replace('"', "")
-        .replace("-", "_")
-        .replace("/", "_")
-        .replace("  ", " ")
-        .replace(" ", "_")
-    )
+    value = (name or "").strip().lower().replace("ў??", "")
+    return _HEADER_SPACES_RE.sub("_", value.translate(_HEADER_TRANSLATION))
 
 
 CSV_IMPORT_MAP = {normalize_header(header): attr for attr, header in PRODUCT_CSV_FIELDS}
@@ -1,7 +1,6 @@
-import json
 import os
 import secrets
-from datetime import datetime
+import time
 from pathlib import Path
 
 from flask import (
@@ -16,17 +15,14 @@ from flask import (
     url_for,
 )
 from flask_login import current_user, login_required
-from sqlalchemy.orm import joinedload
+from sqlalchemy import case, func
+from sqlalchemy.orm import defer, selectinload
 
-from app.services.invoice_service import (
-    InvoiceOcrService,
-    build_match_lookup,
-    match_vendor_code,
-    normalize_invoice_payload,
-)
+from app.services.invoice_ocr_jobs import enqueue_invoice_ocr, loads_payload
 from app.services.order_tasks import update_scan_task_status
 from helpers import user_warehouse
 from models import (
+    Product,
     ScanTask,
     ScanTaskItem,
     SupplierInvoice,
@@ -38,11 +34,22 @@ from models import (
 deliveries_bp = Blueprint("deliveries", __name__)
 
 ALLOWED_INVOICE_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg"}
+INVOICE_MAGIC_BYTES = {
+    ".png": b"\x89PNG\r\n\x1a\n",
+    ".jpg": b"\xff\xd8\xff",
+    ".jpeg": b"\xff\xd8\xff",
+}
+INVOICE_SNIFF_BYTES = 1024
+# Copy uploads in 1 MB chunks instead of werkzeug's 16 KB default.
+INVOICE_UPLOAD_BUFFER_SIZE = 1 << 20
 
 
 def _invoice_upload_dir():
-    upload_root = Path(current_app.static_folder) / "uploads" / "invoices"
-    upload_root.mkdir(parents=True, exist_ok=True)
+    upload_root = current_app.extensions.get("invoice_upload_dir")
+    if upload_root is None:
+        upload_root = Path(current_app.static_folder) / "uploads" / "invoices"
+        upload_root.mkdir(parents=True, exist_ok=True)
+        current_app.extensions["invoice_upload_dir"] = upload_root
     return upload_root
 
 
@@ -52,15 +59,66 @@ def _validate_invoice_upload(file_storage):
     ext = Path(file_storage.filename).suffix.lower()
     if ext not in ALLOWED_INVOICE_EXTENSIONS:
         raise ValueError("Позволени са PDF, PNG, JPG и JPEG файлове.")
+    # Sniff the content so a renamed file is rejected before it reaches OCR.
+    head = file_storage.stream.read(INVOICE_SNIFF_BYTES)
+    file_storage.stream.seek(0)
+    if ext == ".pdf":
+        # PDF readers accept the header anywhere in the first kilobyte
+        valid = b"%PDF-" in head
+    else:
+        valid = head.startswith(INVOICE_MAGIC_BYTES[ext])
+    if not valid:
+        raise ValueError("Съдържанието на файла не отговаря на разширението му.")
+    max_bytes = current_app.config.get("INVOICE_UPLOAD_MAX_BYTES", 15 * 1024 * 1024)
+    # The file is part of the request body, so a small enough body needs no seek on the spooled upload.
+    body_size = request.content_length
+    if body_size is not None and body_size <= max_bytes:
+        return ext
     file_storage.stream.seek(0, os.SEEK_END)
     size = file_storage.stream.tell()
-    max_bytes = current_app.config.get("INVOICE_UPLOAD_MAX_BYTES", 15 * 1024 * 1024)
     if size > max_bytes:
         raise ValueError(f"Файлът е твърде голям (макс. {max_bytes // 1024} KB).")
     file_storage.stream.seek(0)
     return ext
 
 
+def _unmatched_code_expression():
+    """SQL for the code shown for an unmatched line: vendor code, else description."""
+    return func.trim(
+        func.coalesce(
+            func.nullif(SupplierInvoiceLine.vendor_code, ""),
+            func.nullif(SupplierInvoiceLine.description, ""),
+            "",
+        )
+    )
+
+
+def _invoice_lines_loader():
+    """Eager-load invoice lines and matched products with only the columns the views read."""
+    return (
+        selectinload(SupplierInvoice.lines)
+        .load_only(
+            SupplierInvoiceLine.vendor_code,
+            SupplierInvoiceLine.description,
+            SupplierInvoiceLine.quantity,
+            SupplierInvoiceLine.unit,
+            SupplierInvoiceLine.unit_price,
+            SupplierInvoiceLine.matched_product_id,
+            SupplierInvoiceLine.match_method,
+        )
+        .selectinload(SupplierInvoiceLine.matched_product)
+        .load_only(
+            Product.name,
+            Product.barcode,
+            Product.item_number,
+            Product.main_unit,
+            Product.visible_price_unit_1,
+            Product.price_unit_1,
+            Product.price_unit_2,
+        )
+    )
+
+
 @deliveries_bp.route("/deliveries", methods=["GET", "POST"])
 @login_required
 def deliveries_index():
@@ -73,130 +131,90 @@ def deliveries_index():
             flash(str(exc), "warning")
             return redirect(url_for("deliveries.deliveries_index"))
 
-        filename = f"invoice_{datetime.utcnow():%Y%m%d_%H%M%S}_{secrets.token_hex(4)}{ext}"
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.gmtime())
+        filename = f"invoice_{stamp}_{secrets.token_hex(4)}{ext}"
         upload_path = _invoice_upload_dir() / filename
-        file.save(upload_path)
+        file.save(upload_path, buffer_size=INVOICE_UPLOAD_BUFFER_SIZE)
         rel_path = f"uploads/invoices/{filename}"
 
         invoice = SupplierInvoice(
             file_path=rel_path,
-            ocr_status="processing",
+            ocr_status="queued",
             created_by_id=getattr(current_user, "id", None),
         )
         session.add(invoice)
         session.commit()
 
-        try:
-            ocr_service = InvoiceOcrService()
-
-            def _append_page_log(page_num, info):
-                try:
-                    inv = session.get(SupplierInvoice, invoice.id)
-                    logs = json.loads(inv.ocr_pages_log) if inv.ocr_pages_log else []
-                    entry = {
-                        "page": page_num,
-                        "status": info.get("status"),
-                        "timestamp": datetime.utcnow().isoformat(),
-                    }
-                    if info.get("status") == "ok":
-                        res = info.get("result") or {}
-                        entry["line_items_count"] = len(res.get("line_items") or [])
-                        entry["usage"] = info.get("usage") or {}
-                    else:
-                        entry["error"] = str(info.get("error"))[:1000]
-                    logs.append(entry)
-                    inv.ocr_pages_log = json.dumps(logs, ensure_ascii=False)
-                    session.commit()
-                except Exception:
-                    try:
-                        session.rollback()
-                    except Exception:
-                        pass
-                    current_app.logger.exception("Failed to append OCR page log")
-
-            raw_payload, usage = ocr_service.extract_invoice_data(upload_path, progress_callback=_append_page_log)
-            normalized = normalize_invoice_payload(raw_payload)
-
-            invoice.invoice_number = normalized["header"]["invoice_number"]
-            invoice.issue_date = normalized["header"]["issue_date"]
-            invoice.currency = normalized["header"]["currency"]
-            invoice.vendor_name = normalized["vendor"]["name"]
-            invoice.vendor_vat_id = normalized["vendor"]["vat_id"]
-            invoice.vendor_iban = normalized["vendor"]["iban"]
-            invoice.receiver_name = normalized["receiver"]["name"]
-            invoice.receiver_vat_id = normalized["receiver"]["vat_id"]
-            invoice.net_amount = normalized["totals"]["net_amount"]
-            invoice.vat_amount = normalized["totals"]["vat_amount"]
-            invoice.total_due = normalized["totals"]["total_due"]
-            invoice.ocr_payload = json.dumps(raw_payload, ensure_ascii=False)
-            invoice.ocr_status = "success"
-            invoice.error_message = None
-
-            session.query(SupplierInvoiceLine).filter_by(invoice_id=invoice.id).delete()
-            vendor_codes = [item.get("article_no") for item in normalized["line_items"]]
-            lookup = build_match_lookup(session, vendor_codes)
-
-            for idx, item in enumerate(normalized["line_items"], start=1):
-                if not (item.get("article_no") or item.get("description")):
-                    continue
-                product, method = match_vendor_code(item.get("article_no"), lookup)
-                session.add(
-                    SupplierInvoiceLine(
-                        invoice_id=invoice.id,
-                        row_index=idx,
-                        vendor_code=item.get("article_no"),
-                        description=item.get("description"),
-                        quantity=item.get("quantity"),
-                        unit=item.get("unit"),
-                        unit_price=item.get("unit_price"),
-                        total_row=item.get("total_row"),
-                        matched_product_id=product.id if product else None,
-                        match_method=method,
-                    )
-                )
-
-            session.commit()
-            flash("Фактурата е обработена успешно.", "success")
-            return redirect(url_for("deliveries.delivery_detail", invoice_id=invoice.id))
-        except Exception as exc:
-            session.rollback()
-            invoice = session.get(SupplierInvoice, invoice.id)
-            if invoice:
-                invoice.ocr_status = "failed"
-                invoice.error_message = str(exc)[:1000]
-                session.commit()
-            flash("Грешка при обработка на фактурата.", "danger")
-            return redirect(url_for("deliveries.delivery_detail", invoice_id=invoice.id))
+        enqueue_invoice_ocr(current_app._get_current_object(), invoice.id, upload_path)
+        flash("Фактурата е качена и се обработва.", "info")
+        return redirect(url_for("deliveries.delivery_detail", invoice_id=invoice.id))
 
     invoices = (
         session.query(SupplierInvoice)
-        .options(joinedload(SupplierInvoice.lines))
+        .options(defer(SupplierInvoice.ocr_payload), defer(SupplierInvoice.ocr_pages_log))
         .order_by(SupplierInvoice.created_at.desc())
         .limit(50)
         .all()
     )
+    invoice_ids = [inv.id for inv in invoices]
     # Build lightweight stats for each invoice to show in the index
-    invoice_stats = {}
-    for inv in invoices:
-        total_lines = len(inv.lines)
-        matched_lines = sum(1 for l in inv.lines if l.matched_product_id)
-        total_qty = sum((l.quantity or 0) for l in inv.lines)
-        matched_qty = sum((l.quantity or 0) for l in inv.lines if l.matched_product_id)
-        unmatched_codes = [ (l.vendor_code or l.description or "").strip() for l in inv.lines if not l.matched_product_id ]
-        from collections import Counter
-
-        top_unmatched = [c for c, _ in Counter([c for c in unmatched_codes if c]).most_common(5)]
-        pct_lines = (matched_lines / total_lines * 100) if total_lines else 0
-        pct_qty = (matched_qty / total_qty * 100) if total_qty else 0
-        invoice_stats[inv.id] = {
-            "total_lines": total_lines,
-            "matched_lines": matched_lines,
-            "match_pct_lines": round(pct_lines, 1),
-            "total_qty": total_qty,
-            "matched_qty": matched_qty,
-            "match_pct_qty": round(pct_qty, 1),
-            "top_unmatched": top_unmatched,
+    invoice_stats = {
+        inv_id: {
+            "total_lines": 0,
+            "matched_lines": 0,
+            "match_pct_lines": 0,
+            "total_qty": 0,
+            "matched_qty": 0,
+            "match_pct_qty": 0,
+            "top_unmatched": [],
         }
+        for inv_id in invoice_ids
+    }
+    if invoice_ids:
+        is_matched = SupplierInvoiceLine.matched_product_id.isnot(None)
+        qty = func.coalesce(SupplierInvoiceLine.quantity, 0)
+        aggregates = (
+            session.query(
+                SupplierInvoiceLine.invoice_id,
+                func.count(SupplierInvoiceLine.id),
+                func.sum(case((is_matched, 1), else_=0)),
+                func.sum(qty),
+                func.sum(case((is_matched, qty), else_=0)),
+            )
+            .filter(SupplierInvoiceLine.invoice_id.in_(invoice_ids))
+            .group_by(SupplierInvoiceLine.invoice_id)
+            .all()
+        )
+        for inv_id, total_lines, matched_lines, total_qty, matched_qty in aggregates:
+            pct_lines = (matched_lines / total_lines * 100) if total_lines else 0
+            pct_qty = (matched_qty / total_qty * 100) if total_qty else 0
+            invoice_stats[inv_id].update(
+                total_lines=total_lines,
+                matched_lines=matched_lines,
+                match_pct_lines=round(pct_lines, 1),
+                total_qty=total_qty,
+                matched_qty=matched_qty,
+                match_pct_qty=round(pct_qty, 1),
+            )
+
+        unmatched_code = _unmatched_code_expression()
+        unmatched_rows = (
+            session.query(SupplierInvoiceLine.invoice_id, unmatched_code)
+            .filter(SupplierInvoiceLine.invoice_id.in_(invoice_ids))
+            .filter(SupplierInvoiceLine.matched_product_id.is_(None))
+            .filter(unmatched_code != "")
+            .group_by(SupplierInvoiceLine.invoice_id, unmatched_code)
+            .order_by(
+                SupplierInvoiceLine.invoice_id,
+                func.count(SupplierInvoiceLine.id).desc(),
+                func.min(SupplierInvoiceLine.id),
+            )
+            .all()
+        )
+        for inv_id, code in unmatched_rows:
+            top_unmatched = invoice_stats[inv_id]["top_unmatched"]
+            if len(top_unmatched) < 5:
+                top_unmatched.append(code)
 
     return render_template("deliveries_index.html", invoices=invoices, invoice_stats=invoice_stats)
 
@@ -205,19 +223,34 @@ def deliveries_index():
 @login_required
 def delivery_detail(invoice_id):
     session = g.db
-    invoice = (
-        session.query(SupplierInvoice)
-        .options(
-            joinedload(SupplierInvoice.lines).joinedload(SupplierInvoiceLine.matched_product),
-            joinedload(SupplierInvoice.scan_task),
-        )
-        .get(invoice_id)
+    invoice = session.get(
+        SupplierInvoice,
+        invoice_id,
+        options=[defer(SupplierInvoice.ocr_payload), _invoice_lines_loader()],
     )
     if not invoice:
         abort(404)
 
     lines_view = []
+    total_lines = 0
+    matched_lines = 0
+    total_qty = 0
+    matched_qty = 0
+    unmatched_count = 0
+    # breakdown by match method
+    match_method_counts = {}
     for line in invoice.lines:
+        qty = line.quantity or 0
+        total_lines += 1
+        total_qty += qty
+        if line.matched_product_id:
+            matched_lines += 1
+            matched_qty += qty
+        else:
+            unmatched_count += 1
+        key = line.match_method or "unmatched"
+        match_method_counts[key] = match_method_counts.get(key, 0) + 1
+
         product = line.matched_product
         internal_price = None
         if product:
@@ -241,28 +274,25 @@ def delivery_detail(invoice_id):
             }
         )
 
-    total_lines = len(invoice.lines)
-    matched_lines = sum(1 for line in invoice.lines if line.matched_product_id)
-    total_qty = sum((l.quantity or 0) for l in invoice.lines)
-    matched_qty = sum((l.quantity or 0) for l in invoice.lines if l.matched_product_id)
-    unmatched_lines = [l for l in invoice.lines if not l.matched_product_id]
-    unmatched_count = len(unmatched_lines)
-    # breakdown by match method
-    match_method_counts = {}
-    for l in invoice.lines:
-        key = l.match_method or "unmatched"
-        match_method_counts[key] = match_method_counts.get(key, 0) + 1
     # top unmatched vendor codes (for manual review / training)
-    from collections import Counter
-
-    top_unmatched = [c for c, _ in Counter([ (l.vendor_code or l.description or "").strip() for l in unmatched_lines if (l.vendor_code or l.description) ]).most_common(10)]
+    unmatched_code = _unmatched_code_expression()
+    top_unmatched = [
+        code
+        for (code,) in session.query(unmatched_code)
+        .filter(SupplierInvoiceLine.invoice_id == invoice.id)
+        .filter(SupplierInvoiceLine.matched_product_id.is_(None))
+        .filter(unmatched_code != "")
+        .group_by(unmatched_code)
+        .order_by(func.count(SupplierInvoiceLine.id).desc(), func.min(SupplierInvoiceLine.id))
+        .limit(10)
+    ]
     default_warehouse = user_warehouse(current_user)
     warehouses = session.query(Warehouse).order_by(Warehouse.name).all()
     # parse per-page OCR logs for display
     ocr_pages_log = []
     try:
         if invoice.ocr_pages_log:
-            ocr_pages_log = json.loads(invoice.ocr_pages_log)
+            ocr_pages_log = loads_payload(invoice.ocr_pages_log)
     except Exception:
         current_app.logger.exception("Failed to parse invoice.ocr_pages_log")
 
@@ -287,10 +317,10 @@ def delivery_detail(invoice_id):
 @login_required
 def delivery_create_scan_task(invoice_id):
     session = g.db
-    invoice = (
-        session.query(SupplierInvoice)
-        .options(joinedload(SupplierInvoice.lines).joinedload(SupplierInvoiceLine.matched_product))
-        .get(invoice_id)
+    invoice = session.get(
+        SupplierInvoice,
+        invoice_id,
+        options=[defer(SupplierInvoice.ocr_payload), defer(SupplierInvoice.ocr_pages_log), _invoice_lines_loader()],
     )
     if not invoice:
         abort(404)
@@ -329,33 +359,37 @@ def delivery_create_scan_task(invoice_id):
         qty = line.quantity or 0
         if qty <= 0:
             continue
-        key = (barcode, product.id if product else None)
-        bucket = aggregated.setdefault(
-            key,
-            {
+        product_id = product.id if product else None
+        key = (barcode, product_id)
+        bucket = aggregated.get(key)
+        if bucket is None:
+            aggregated[key] = {
                 "barcode": barcode,
-                "product_id": product.id if product else None,
-                "qty": 0.0,
+                "product_id": product_id,
+                "qty": float(qty),
                 "unit": product.main_unit if product else line.unit,
-            },
-        )
-        bucket["qty"] += qty
+            }
+        else:
+            bucket["qty"] += qty
 
     if not aggregated:
         flash("Няма редове за сканиране.", "warning")
         return redirect(url_for("deliveries.delivery_detail", invoice_id=invoice.id))
 
-    for payload in aggregated.values():
-        session.add(
-            ScanTaskItem(
-                task_id=task.id,
-                product_id=payload["product_id"],
-                barcode=payload["barcode"],
-                expected_qty=payload["qty"],
-                scanned_qty=0.0,
-                unit=payload["unit"],
-            )
-        )
+    session.bulk_insert_mappings(
+        ScanTaskItem,
+        [
+            {
+                "task_id": task.id,
+                "product_id": payload["product_id"],
+                "barcode": payload["barcode"],
+                "expected_qty": payload["qty"],
+                "scanned_qty": 0.0,
+                "unit": payload["unit"],
+            }
+            for payload in aggregated.values()
+        ],
+    )
 
     update_scan_task_status(task)
     invoice.scan_task_id = task.id
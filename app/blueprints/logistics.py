@@ -1,10 +1,23 @@
+import hashlib
 import qrcode
+import re
+import time
 from datetime import datetime
+from functools import lru_cache
 from io import BytesIO
+from urllib.parse import quote
+
+from .catalog_sync import catalog_generation
+
+try:
+    import segno
+except ImportError:  # pragma: no cover - optional dependency
+    segno = None
 
 from flask import (
     Blueprint,
     abort,
+    current_app,
     flash,
     g,
     redirect,
@@ -14,16 +27,15 @@ from flask import (
     url_for,
 )
 from flask_login import current_user, login_required
-from reportlab.lib.pagesizes import A6, landscape
-from reportlab.lib.units import mm
-from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas
-from sqlalchemy import func, or_
-from sqlalchemy.orm import joinedload
-
-from constants import DEFAULT_PRODUCT_IMAGE, PDF_FONT_NAME
+from sqlalchemy import func, lambda_stmt, or_, select, update
+from sqlalchemy.orm import joinedload, raiseload, selectinload
+
+from app.services.pallet_labels import enqueue_pallet_label, pallet_label_file, pallet_label_options
+from constants import DEFAULT_PRODUCT_IMAGE
+from helpers import view_mode_urls
 from models import Product, ProductList, ProductListItem, TransferDocument
 from utils import (
+    bulk_list_totals,
     calculate_list_totals,
     canonical_unit_name,
     default_warehouse_for_user,
@@ -38,34 +50,107 @@ from utils import (
 
 logistics_bp = Blueprint("logistics", __name__)
 
+# List and pallet codes are generated as PREFIX-YYYYMMDD-HEX (String(64) columns).
+_LIST_CODE_RE = re.compile(r"[A-Z0-9_-]{4,64}")
 
-def _get_product_by_number(session, item_number):
-    code = (item_number or "").strip()
-    if not code:
-        return None
-    return (
-        session.query(Product)
-        .filter(func.upper(Product.item_number) == code.upper())
-        .first()
+# Characters werkzeug leaves unescaped in URL paths, so quote() matches url_for("static", ...).
+STATIC_URL_SAFE_CHARS = "/:@!$&'()*+,;=~"
+
+# The item datalist is rebuilt when the catalog generation changes (import/sync);
+# the TTL bounds staleness from single-product edits.
+PRODUCT_OPTIONS_CACHE_SECONDS = 60
+
+_product_options_cache = {"marker": None, "expires_at": 0.0, "options": []}
+
+# The index queries take no parameters, so lambda_stmt builds and cache-keys them once per process.
+_PALLET_LIST_STMT = lambda_stmt(
+    lambda: select(ProductList)
+    .options(
+        joinedload(ProductList.current_warehouse),
+        joinedload(ProductList.target_warehouse),
+        raiseload("*"),
+    )
+    .where(ProductList.is_light.is_(False))
+    .order_by(ProductList.created_at.desc())
+)
+_SIMPLE_LIST_INDEX_STMT = lambda_stmt(
+    lambda: select(ProductList)
+    .options(
+        joinedload(ProductList.current_warehouse),
+        joinedload(ProductList.created_by),
+        raiseload("*"),
     )
+    .where(ProductList.is_light.is_(True))
+    .order_by(ProductList.created_at.desc())
+)
+_TRANSFERS_STMT = lambda_stmt(
+    lambda: select(TransferDocument)
+    .options(
+        joinedload(TransferDocument.product_list),
+        joinedload(TransferDocument.from_warehouse),
+        joinedload(TransferDocument.to_warehouse),
+        raiseload("*"),
+    )
+    .order_by(TransferDocument.created_at.desc())
+)
+
+
+@lru_cache(maxsize=1024)
+def _qr_png_bytes(payload: str) -> bytes:
+    # List and pallet codes never change once issued, so the encoded PNG can be reused.
+    buffer = BytesIO()
+    if segno is not None:
+        # Same symbol size as qrcode.make (level M, 10px modules, 4-module border); make_qr avoids Micro QR.
+        segno.make_qr(payload, error="m", boost_error=False).save(buffer, kind="png", scale=10, border=4)
+    else:
+        qrcode.make(payload).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _product_options(session):
+    """Return (item_number, name) rows for the list form datalist, cached per catalog version."""
+    now = time.monotonic()
+    cache = _product_options_cache
+    marker = catalog_generation()
+    if cache["marker"] != marker or now >= cache["expires_at"]:
+        options = session.query(Product.item_number, Product.name).order_by(Product.item_number).all()
+        cache.update(
+            marker=marker,
+            expires_at=now + PRODUCT_OPTIONS_CACHE_SECONDS,
+            options=options,
+        )
+    return cache["options"]
+
+
+def _products_by_number(session, item_numbers):
+    """Map upper-cased item numbers to products with one IN query (uses ix_products_item_number_upper)."""
+    codes = {code.strip().upper() for code in item_numbers if code and code.strip()}
+    if not codes:
+        return {}
+    products = {}
+    for product in (
+        session.query(Product)
+        .filter(func.upper(Product.item_number).in_(codes))
+        .order_by(Product.id)
+    ):
+        products.setdefault(product.item_number.upper(), product)
+    return products
 
 
 def _resolve_unit_label(product, unit_mode):
     if not product:
         return "pcs"
     mode = (unit_mode or "").lower()
-
-    def _match(mode_name):
-        for candidate in (product.main_unit, product.secondary_unit):
-            if canonical_unit_name(candidate) == mode_name:
-                return candidate
-        return None
-
+    fallback = product.main_unit or product.secondary_unit or "pcs"
+    if mode not in {"packages", "pieces", "pieces_from_packages"}:
+        return fallback
+    # canonicalize each of the product's units once, then pick by preference
+    units_by_name = {}
+    for candidate in (product.main_unit, product.secondary_unit):
+        units_by_name.setdefault(canonical_unit_name(candidate), candidate)
     if mode == "packages":
-        return _match("packages") or _match("pieces") or product.main_unit or product.secondary_unit or "pcs"
-    if mode in {"pieces", "pieces_from_packages"}:
-        return _match("pieces") or product.main_unit or product.secondary_unit or "pcs"
-    return product.main_unit or product.secondary_unit or "pcs"
+        return units_by_name.get("packages") or units_by_name.get("pieces") or fallback
+    return units_by_name.get("pieces") or fallback
 
 
 def _collect_items_from_form():
@@ -95,46 +180,41 @@ def _collect_items_from_form():
     return rows
 
 
-def _populate_list_from_form(product_list, rows):
+def _populate_list_from_form(product_list, rows, products=None):
+    """Replace the list items with ``rows``; ``products`` may carry an already built _products_by_number map."""
     session = g.db
-    product_list.items.clear()
+    if products is None:
+        products = _products_by_number(session, [row["item_number"] for row in rows])
+    item_rows = []
     for row in rows:
-        product = _get_product_by_number(session, row["item_number"])
+        product = products.get(row["item_number"].strip().upper())
         if not product:
             raise ValueError(f"Product {row['item_number']} was not found.")
-        unit_label = _resolve_unit_label(product, row.get("unit_mode"))
-        product_list.items.append(
-            ProductListItem(product=product, quantity=row["quantity"], unit=unit_label)
+        item_rows.append(
+            {
+                "product_id": product.id,
+                "quantity": row["quantity"],
+                "unit": _resolve_unit_label(product, row.get("unit_mode")),
+            }
         )
-
-
-def _populate_simple_list(product_list, rows):
-    _populate_list_from_form(product_list, rows)
+    # one DELETE and one executemany INSERT instead of per-item ORM bookkeeping
+    session.flush()
+    session.query(ProductListItem).filter(ProductListItem.list_id == product_list.id).delete(
+        synchronize_session=False
+    )
+    for item_row in item_rows:
+        item_row["list_id"] = product_list.id
+    session.bulk_insert_mappings(ProductListItem, item_rows)
+    session.expire(product_list, ["items"])
 
 
 @logistics_bp.route("/lists")
 @logistics_bp.route("/pallets")
 def pallet_list():
     session = g.db
-    view_mode = request.args.get("view", "cards")
-    if view_mode not in ("cards", "table"):
-        view_mode = "cards"
-    base_args = request.args.to_dict()
-    base_args.pop("view", None)
-    cards_url = url_for(".pallet_list", **{**base_args, "view": "cards"})
-    table_url = url_for(".pallet_list", **{**base_args, "view": "table"})
-    product_lists = (
-        session.query(ProductList)
-        .options(
-            joinedload(ProductList.current_warehouse),
-            joinedload(ProductList.target_warehouse),
-            joinedload(ProductList.items).joinedload(ProductListItem.product),
-        )
-        .filter(ProductList.is_light.is_(False))
-        .order_by(ProductList.created_at.desc())
-        .all()
-    )
-    totals_by_list = {p.id: calculate_list_totals(p) for p in product_lists}
+    view_mode, cards_url, table_url = view_mode_urls(".pallet_list")
+    product_lists = session.execute(_PALLET_LIST_STMT).scalars().all()
+    totals_by_list = bulk_list_totals(session, [p.id for p in product_lists])
     return render_template(
         "pallet_list.html",
         product_lists=product_lists,
@@ -150,7 +230,7 @@ def pallet_list():
 def new_pallet():
     session = g.db
     warehouses = load_warehouses(session)
-    product_options = session.query(Product).order_by(Product.item_number).all()
+    product_options = _product_options(session)
     return render_template(
         "pallet_new.html",
         warehouses=warehouses,
@@ -165,25 +245,9 @@ def new_pallet():
 @login_required
 def simple_list_index():
     session = g.db
-    view_mode = request.args.get("view", "cards")
-    if view_mode not in ("cards", "table"):
-        view_mode = "cards"
-    base_args = request.args.to_dict()
-    base_args.pop("view", None)
-    cards_url = url_for(".simple_list_index", **{**base_args, "view": "cards"})
-    table_url = url_for(".simple_list_index", **{**base_args, "view": "table"})
-    product_lists = (
-        session.query(ProductList)
-        .options(
-            joinedload(ProductList.current_warehouse),
-            joinedload(ProductList.created_by),
-            joinedload(ProductList.items).joinedload(ProductListItem.product),
-        )
-        .filter(ProductList.is_light.is_(True))
-        .order_by(ProductList.created_at.desc())
-        .all()
-    )
-    totals_by_list = {p.id: calculate_list_totals(p) for p in product_lists}
+    view_mode, cards_url, table_url = view_mode_urls(".simple_list_index")
+    product_lists = session.execute(_SIMPLE_LIST_INDEX_STMT).scalars().all()
+    totals_by_list = bulk_list_totals(session, [p.id for p in product_lists])
     return render_template(
         "simple_list_index.html",
         product_lists=product_lists,
@@ -233,7 +297,7 @@ def simple_list_create():
     )
     session.add(product_list)
     try:
-        _populate_simple_list(product_list, rows)
+        _populate_list_from_form(product_list, rows)
     except ValueError as exc:
         session.rollback()
         flash(str(exc), "danger")
@@ -262,6 +326,8 @@ def simple_list_edit(list_id):
     if not user or not warehouse:
         flash("Assign a default warehouse before editing lists.", "warning")
         return redirect(url_for(".simple_list_index"))
+    # resolve the static root once instead of building a URL per item
+    static_root = url_for("static", filename="").rstrip("/")
     existing_items = [
         {
             "item_number": item.product.item_number,
@@ -272,7 +338,7 @@ def simple_list_edit(list_id):
             "storage_location": item.product.storage_location,
             "unit_mode": canonical_unit_name(item.unit) or "manual",
             "image_url": (
-                url_for("static", filename=item.product.image_url.lstrip("/"))
+                f"{static_root}/{quote(item.product.image_url.lstrip('/'), safe=STATIC_URL_SAFE_CHARS)}"
                 if item.product.image_url
                 and item.product.image_url != DEFAULT_PRODUCT_IMAGE
                 else None
@@ -295,7 +361,6 @@ def simple_list_update(list_id):
     session = g.db
     product_list = (
         session.query(ProductList)
-        .options(joinedload(ProductList.items))
         .filter(ProductList.id == list_id, ProductList.is_light.is_(True))
         .first()
     )
@@ -307,7 +372,7 @@ def simple_list_update(list_id):
         flash(str(exc), "danger")
         return redirect(url_for(".simple_list_edit", list_id=list_id))
     try:
-        _populate_simple_list(product_list, rows)
+        _populate_list_from_form(product_list, rows)
     except ValueError as exc:
         flash(str(exc), "danger")
         return redirect(url_for(".simple_list_edit", list_id=list_id))
@@ -325,7 +390,7 @@ def simple_list_detail(list_id):
         .options(
             joinedload(ProductList.current_warehouse),
             joinedload(ProductList.created_by),
-            joinedload(ProductList.items).joinedload(ProductListItem.product),
+            selectinload(ProductList.items).selectinload(ProductListItem.product),
         )
         .filter(ProductList.id == list_id, ProductList.is_light.is_(True))
         .first()
@@ -389,7 +454,7 @@ def edit_list(list_id):
     if product_list is None:
         abort(404)
     warehouses = load_warehouses(session)
-    product_options = session.query(Product).order_by(Product.item_number).all()
+    product_options = _product_options(session)
     existing_items = [
         {"item_number": item.product.item_number, "quantity": item.quantity, "name": item.product.name}
         for item in product_list.items
@@ -407,7 +472,7 @@ def edit_list(list_id):
 @logistics_bp.route("/lists/<int:list_id>/update", methods=["POST"])
 def update_list(list_id):
     session = g.db
-    product_list = session.query(ProductList).options(joinedload(ProductList.items)).get(list_id)
+    product_list = session.get(ProductList, list_id)
     if product_list is None:
         abort(404)
     if not request.form.get("source_warehouse_id"):
@@ -422,6 +487,7 @@ def update_list(list_id):
     if product_list.status == "received":
         product_list.status = "draft"
     session.commit()
+    enqueue_pallet_label(current_app._get_current_object(), list_id)
     flash("List updated successfully.", "success")
     return redirect(url_for(".pallet_detail", list_id=list_id))
 
@@ -430,17 +496,17 @@ def update_list(list_id):
 @logistics_bp.route("/pallets/<int:list_id>")
 def pallet_detail(list_id):
     session = g.db
-    product_list = (
-        session.query(ProductList)
-        .options(
+    product_list = session.get(
+        ProductList,
+        list_id,
+        options=[
             joinedload(ProductList.current_warehouse),
             joinedload(ProductList.target_warehouse),
-            joinedload(ProductList.items).joinedload(ProductListItem.product),
-            joinedload(ProductList.transfers).joinedload(TransferDocument.from_warehouse),
-            joinedload(ProductList.transfers).joinedload(TransferDocument.to_warehouse),
+            selectinload(ProductList.items).selectinload(ProductListItem.product),
+            selectinload(ProductList.transfers).joinedload(TransferDocument.from_warehouse),
+            selectinload(ProductList.transfers).joinedload(TransferDocument.to_warehouse),
             joinedload(ProductList.created_by),
-        )
-        .get(list_id)
+        ],
     )
     if product_list is None:
         abort(404)
@@ -463,95 +529,67 @@ def pallet_qr(list_id):
     if product_list is None:
         abort(404)
     payload = product_list.pallet_code or product_list.code
-    img = qrcode.make(payload)
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    buffer.seek(0)
-    return send_file(buffer, mimetype="image/png")
+    response = send_file(
+        BytesIO(_qr_png_bytes(payload)),
+        mimetype="image/png",
+        etag=hashlib.sha1(payload.encode("utf-8")).hexdigest(),
+        last_modified=product_list.updated_at,
+        conditional=True,
+    )
+    # The URL is per list but the payload changes on palletize, so revalidate instead of max-age.
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
 
 
 @logistics_bp.route("/lists/<int:list_id>/label")
 def pallet_label(list_id):
     session = g.db
-    product_list = (
-        session.query(ProductList)
-        .options(
-            joinedload(ProductList.current_warehouse),
-            joinedload(ProductList.target_warehouse),
-        )
-        .get(list_id)
-    )
+    product_list = session.get(ProductList, list_id, options=pallet_label_options())
     if product_list is None:
         abort(404)
-    totals = calculate_list_totals(product_list)
-    buffer = BytesIO()
-    page_size = landscape(A6)
-    pdf = canvas.Canvas(buffer, pagesize=page_size)
-    pdf.setFont(PDF_FONT_NAME, 16)
-    pdf.drawString(15 * mm, page_size[1] - 20 * mm, product_list.title)
-    pdf.setFont(PDF_FONT_NAME, 12)
-    pdf.drawString(15 * mm, page_size[1] - 30 * mm, f"Code: {product_list.code}")
-    if product_list.pallet_code:
-        pdf.drawString(15 * mm, page_size[1] - 38 * mm, f"Pallet: {product_list.pallet_code}")
-    pdf.drawString(15 * mm, page_size[1] - 48 * mm, f"From: {product_list.current_warehouse.name}")
-    pdf.drawString(
-        15 * mm,
-        page_size[1] - 56 * mm,
-        f"To: {product_list.target_warehouse.name if product_list.target_warehouse else 'N/A'}",
-    )
-    pdf.drawString(15 * mm, page_size[1] - 66 * mm, f"Status: {product_list.status.upper()}")
-    location_text = product_list.storage_location or "No location provided"
-    pdf.drawString(15 * mm, page_size[1] - 74 * mm, f"Location: {location_text}")
-    pdf.drawString(
-        15 * mm,
-        page_size[1] - 82 * mm,
-        f"Items: {totals['total_quantity']:.2f} ({totals['line_count']} rows)",
-    )
-    pdf.drawString(15 * mm, page_size[1] - 90 * mm, f"Weight: {totals['total_weight']:.2f} kg")
-    pdf.drawString(15 * mm, page_size[1] - 98 * mm, f"Volume: {totals['total_volume']:.3f} m³")
-    img = qrcode.make(product_list.pallet_code or product_list.code)
-    qr_buffer = BytesIO()
-    img.save(qr_buffer, format="PNG")
-    qr_buffer.seek(0)
-    pdf.drawImage(
-        ImageReader(qr_buffer),
-        page_size[0] - 70 * mm,
-        page_size[1] - 95 * mm,
-        50 * mm,
-        50 * mm,
+    return send_file(
+        pallet_label_file(product_list),
+        mimetype="application/pdf",
+        download_name=f"{product_list.code}.pdf",
     )
-    pdf.showPage()
-    pdf.save()
-    buffer.seek(0)
-    filename = f"{product_list.code}.pdf"
-    return send_file(buffer, mimetype="application/pdf", download_name=filename)
 
 
 @logistics_bp.route("/lists/<int:list_id>/palletize", methods=["POST"])
 def palletize_list(list_id):
     session = g.db
-    product_list = session.get(ProductList, list_id)
-    if product_list is None:
-        abort(404)
-    if product_list.is_pallet:
+    pallet_code = generate_pallet_code(session)
+    # guarded UPDATE: assigns the code without loading the row and cannot palletize twice
+    result = session.execute(
+        update(ProductList)
+        .where(ProductList.id == list_id, ProductList.is_pallet.isnot(True))
+        .values(
+            is_pallet=True,
+            pallet_code=pallet_code,
+            status="palletized",
+            updated_at=datetime.utcnow(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        session.rollback()
+        if session.get(ProductList, list_id) is None:
+            abort(404)
         flash("List is already palletized.", "warning")
         return redirect(url_for(".pallet_detail", list_id=list_id))
-    product_list.is_pallet = True
-    product_list.pallet_code = generate_pallet_code(session)
-    product_list.status = "palletized"
-    product_list.updated_at = datetime.utcnow()
     session.commit()
-    flash(f"Pallet code assigned ({product_list.pallet_code}).")
+    enqueue_pallet_label(current_app._get_current_object(), list_id)
+    flash(f"Pallet code assigned ({pallet_code}).")
     return redirect(url_for(".pallet_detail", list_id=list_id))
 
 
 @logistics_bp.route("/lists/<int:list_id>/transfer", methods=["GET", "POST"])
 def transfer_list(list_id):
     session = g.db
-    product_list = (
-        session.query(ProductList)
-        .options(joinedload(ProductList.current_warehouse), joinedload(ProductList.target_warehouse))
-        .get(list_id)
+    product_list = session.get(
+        ProductList,
+        list_id,
+        options=[joinedload(ProductList.current_warehouse), joinedload(ProductList.target_warehouse)],
     )
     if product_list is None:
         abort(404)
@@ -592,23 +630,8 @@ def transfer_list(list_id):
 @logistics_bp.route("/transfers")
 def transfers():
     session = g.db
-    view_mode = request.args.get("view", "cards")
-    if view_mode not in ("cards", "table"):
-        view_mode = "cards"
-    base_args = request.args.to_dict()
-    base_args.pop("view", None)
-    cards_url = url_for(".transfers", **{**base_args, "view": "cards"})
-    table_url = url_for(".transfers", **{**base_args, "view": "table"})
-    documents = (
-        session.query(TransferDocument)
-        .options(
-            joinedload(TransferDocument.product_list),
-            joinedload(TransferDocument.from_warehouse),
-            joinedload(TransferDocument.to_warehouse),
-        )
-        .order_by(TransferDocument.created_at.desc())
-        .all()
-    )
+    view_mode, cards_url, table_url = view_mode_urls(".transfers")
+    documents = session.execute(_TRANSFERS_STMT).scalars().all()
     return render_template(
         "transfers.html",
         documents=documents,
@@ -625,22 +648,30 @@ def receive():
     scanned_list = None
     transfer = None
     totals = None
-    if code:
-        normalized = code.strip().upper()
+    normalized = (code or "").strip().upper()
+    # scans that cannot be a list or pallet code never reach the database
+    if _LIST_CODE_RE.fullmatch(normalized):
+        # the lambda is cached by code location; ``normalized`` is tracked as a bound parameter
         scanned_list = (
-            session.query(ProductList)
-            .options(
-                joinedload(ProductList.current_warehouse),
-                joinedload(ProductList.target_warehouse),
-                joinedload(ProductList.items).joinedload(ProductListItem.product),
-                joinedload(ProductList.transfers),
-            )
-            .filter(
-                or_(
-                    func.upper(ProductList.code) == normalized,
-                    func.upper(ProductList.pallet_code) == normalized,
+            session.execute(
+                lambda_stmt(
+                    lambda: select(ProductList)
+                    .options(
+                        joinedload(ProductList.current_warehouse),
+                        joinedload(ProductList.target_warehouse),
+                        selectinload(ProductList.items).selectinload(ProductListItem.product),
+                        selectinload(ProductList.transfers),
+                    )
+                    .where(
+                        or_(
+                            func.upper(ProductList.code) == normalized,
+                            func.upper(ProductList.pallet_code) == normalized,
+                        )
+                    )
+                    .limit(1)
                 )
             )
+            .scalars()
             .first()
         )
         if scanned_list:
@@ -654,24 +685,30 @@ def receive():
 @logistics_bp.route("/receive/<int:transfer_id>/complete", methods=["POST"])
 def complete_receive(transfer_id):
     session = g.db
-    transfer = (
-        session.query(TransferDocument)
-        .options(
-            joinedload(TransferDocument.product_list).joinedload(ProductList.current_warehouse),
-            joinedload(TransferDocument.to_warehouse),
-        )
-        .get(transfer_id)
-    )
-    if transfer is None or transfer.status != "in_transit":
+    now = datetime.utcnow()
+    # only an in-transit transfer flips to received; RETURNING hands back what the list update needs
+    received = session.execute(
+        update(TransferDocument)
+        .where(TransferDocument.id == transfer_id, TransferDocument.status == "in_transit")
+        .values(status="received", received_at=now)
+        .returning(TransferDocument.list_id, TransferDocument.to_warehouse_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if received is None:
+        session.rollback()
         flash("This transfer cannot be completed.", "warning")
         return redirect(url_for(".receive"))
-    product_list = transfer.product_list
-    product_list.current_warehouse_id = transfer.to_warehouse_id
-    product_list.target_warehouse_id = None
-    product_list.status = "received"
-    product_list.updated_at = datetime.utcnow()
-    transfer.status = "received"
-    transfer.received_at = datetime.utcnow()
+    session.execute(
+        update(ProductList)
+        .where(ProductList.id == received.list_id)
+        .values(
+            current_warehouse_id=received.to_warehouse_id,
+            target_warehouse_id=None,
+            status="received",
+            updated_at=now,
+        )
+        .execution_options(synchronize_session=False)
+    )
     session.commit()
     flash("Transfer completed and list updated.", "success")
-    return redirect(url_for(".pallet_detail", list_id=product_list.id))
+    return redirect(url_for(".pallet_detail", list_id=received.list_id))
@@ -1,3 +1,7 @@
+import base64
+import json
+import logging
+from collections import defaultdict
 from datetime import datetime
 from pathlib import Path
 
@@ -15,7 +19,8 @@ from flask import (
     url_for,
 )
 from flask_login import login_required
-from sqlalchemy.orm import joinedload
+from sqlalchemy import delete, insert, tuple_
+from sqlalchemy.orm import joinedload, selectinload
 
 from constants import (
     PPP_STATIC_DIR,
@@ -31,44 +36,132 @@ from models import (
     ScanEvent,
     ScanTask,
     ScanTaskItem,
-    ServicePoint,
     StockOrder,
     StockOrderAssignment,
     StockOrderItem,
 )
-from utils import generate_ppp_pdf, save_signature_image
-from helpers import parse_float
+from utils import generate_ppp_pdf, ppp_pdf_reference, save_signature_image
+from helpers import parse_float, view_mode_urls
 from app.services.order_tasks import (
+    accessible_service_point_ids,
     apply_inventory_movement,
     attach_service_point_sections,
     assignment_load_counts,
     build_service_point_candidates,
+    enqueue_ppp_draft,
     ensure_scan_task_for_order,
     find_product_by_barcode,
     get_stock_order_with_details,
+    order_items_by_product,
     order_service_point_ids,
     record_scan_event,
+    scan_event_values,
     stock_order_erp_input_payload,
     stock_order_erp_output_payload,
     stock_order_status_counts,
     update_scan_task_status,
     update_stock_order_status,
-    user_service_point_ids,
 )
 
 
 orders_bp = Blueprint("orders", __name__)
 
+STOCK_ORDER_DASHBOARD_PAGE_SIZE = 15
+PPP_DOCUMENTS_PAGE_SIZE = 30
+PPP_SIGNED_PDF_MAX_AGE = 3600
+SCAN_BATCH_MAX_SIZE = 200
+
+
+def _encode_order_cursor(timestamp, order_id):
+    raw = json.dumps([timestamp.isoformat(), order_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_order_cursor(token):
+    if not token:
+        return None
+    try:
+        timestamp, order_id = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        return datetime.fromisoformat(timestamp), int(order_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _keyset_page(query, column, per_page, endpoint):
+    """Return one newest-first page of orders keyed on (column, id) plus the older/newest page URLs."""
+    # keep repeated filter params (e.g. several statuses) in the page links
+    args = request.args.to_dict(flat=False)
+    cursor = _decode_order_cursor(args.pop("cursor", [None])[0])
+    if cursor:
+        query = query.filter(tuple_(column, StockOrder.id) < cursor)
+    rows = query.order_by(column.desc(), StockOrder.id.desc()).limit(per_page + 1).all()
+    orders = rows[:per_page]
+    older_url = None
+    if len(rows) > per_page:
+        last = orders[-1]
+        older_url = url_for(endpoint, **{**args, "cursor": _encode_order_cursor(getattr(last, column.key), last.id)})
+    newest_url = url_for(endpoint, **args) if cursor else None
+    return orders, older_url, newest_url
+
+
+def _ensure_ppp_pdf(order_id, document, pdf_reference):
+    """Return the PPP file path, rendering it again if the background draft never got written."""
+    pdf_path = PPP_STATIC_DIR / Path(pdf_reference).name
+    if pdf_path.exists():
+        return pdf_path
+    prefix = Path(ppp_pdf_reference(order_id, "")).stem
+    if not pdf_path.stem.startswith(prefix):
+        return None
+    order = get_stock_order_with_details(order_id)
+    if order is None:
+        return None
+    signature_rel_path = document.signature_image if pdf_reference == document.signed_pdf_url else None
+    generate_ppp_pdf(order, signature_rel_path=signature_rel_path, identifier=pdf_path.stem[len(prefix):])
+    return pdf_path if pdf_path.exists() else None
+
 
 def _log_order_context(prefix: str, order: StockOrder, extra: str | None = None):
+    logger = current_app.logger
+    # Callers log after commit, so touching the order here reloads it and its items.
+    if not logger.isEnabledFor(logging.INFO):
+        return
     items_summary = ", ".join(
         f"id={item.id} prepared={item.quantity_prepared:.2f} ordered={item.quantity_ordered:.2f} delivered={item.quantity_delivered:.2f}"
         for item in order.items
     )
-    message = f"{prefix} order={order.id} status={order.status} {items_summary}"
     if extra:
-        message = f"{message} | {extra}"
-    current_app.logger.info(message)
+        logger.info("%s order=%s status=%s %s | %s", prefix, order.id, order.status, items_summary, extra)
+    else:
+        logger.info("%s order=%s status=%s %s", prefix, order.id, order.status, items_summary)
+
+
+def _prepared_item_result(order, order_item, product_name):
+    """Build the scan/manual JSON before commit, while the order, item and product are still loaded."""
+    return {
+        "success": True,
+        "item": {
+            "item_id": order_item.id,
+            "product": product_name,
+            "ordered": order_item.quantity_ordered,
+            "prepared": order_item.quantity_prepared,
+            "delivered": order_item.quantity_delivered,
+            "remaining": order_item.remaining_to_prepare,
+            "status": order_item.preparation_status,
+        },
+        "order_status": order.status,
+        "order_status_label": STOCK_ORDER_STATUS_LABELS.get(order.status, order.status),
+    }
+
+
+def _write_assignments(session, order, removed_ids, new_rows):
+    """Apply assignment changes with one DELETE and one multi-row INSERT, then reload order.assignments."""
+    if removed_ids:
+        session.execute(delete(StockOrderAssignment).where(StockOrderAssignment.id.in_(removed_ids)))
+    if new_rows:
+        session.execute(insert(StockOrderAssignment), new_rows)
+    if removed_ids or new_rows:
+        # the status below depends on whether any assignment is left
+        session.expire(order, ["assignments"])
 
 
 @orders_bp.route("/stock-orders", endpoint="stock_orders_dashboard")
@@ -85,14 +178,11 @@ def stock_orders_dashboard():
         query = query.filter(StockOrder.status != "delivered")
     if type_filter:
         query = query.filter(StockOrder.type == type_filter)
-    orders = query.order_by(StockOrder.created_at.desc()).limit(15).all()
+    orders, older_url, newest_url = _keyset_page(
+        query, StockOrder.created_at, STOCK_ORDER_DASHBOARD_PAGE_SIZE, "orders.stock_orders_dashboard"
+    )
     attach_service_point_sections(orders)
-    base_args = request.args.to_dict()
-    view_mode = base_args.pop("view", "cards")
-    if view_mode not in ("cards", "table"):
-        view_mode = "cards"
-    cards_url = url_for("orders.stock_orders_dashboard", **{**base_args, "view": "cards"})
-    table_url = url_for("orders.stock_orders_dashboard", **{**base_args, "view": "table"})
+    view_mode, cards_url, table_url = view_mode_urls("orders.stock_orders_dashboard")
     context = {
         "orders": orders,
         "status_counts": stock_order_status_counts(session),
@@ -110,6 +200,8 @@ def stock_orders_dashboard():
         "view_mode": view_mode,
         "cards_url": cards_url,
         "table_url": table_url,
+        "older_url": older_url,
+        "newest_url": newest_url,
         "status_classes": STATUS_BADGE_CLASSES,
     }
     return render_template("stock_orders_dashboard.html", **context)
@@ -125,7 +217,7 @@ def stock_orders_assigned():
     query = session.query(StockOrder)
     for option in STOCK_ORDER_EAGER_OPTIONS:
         query = query.options(option)
-    query = query.join(StockOrder.assignments).filter(StockOrderAssignment.user_id == user.id)
+    query = query.filter(StockOrder.assignments.any(StockOrderAssignment.user_id == user.id))
     query = query.filter(
         StockOrder.status.in_(["assigned", "in_progress", "ready_for_handover", "partially_delivered"])
     )
@@ -160,6 +252,8 @@ def stock_order_assign(order_id):
     if order is None:
         abort(404)
     service_point_ids = order_service_point_ids(order)
+    removed_ids = []
+    new_rows = []
     for sp_id in service_point_ids:
         field_name = f"service_point_{sp_id}"
         raw_values = request.form.getlist(field_name)
@@ -175,18 +269,13 @@ def stock_order_assign(order_id):
                 break
         assignments = [a for a in order.assignments if a.service_point_id == sp_id]
         existing_ids = {a.user_id for a in assignments}
-        for assignment in assignments:
-            if assignment.user_id not in selected:
-                session.delete(assignment)
-        for candidate in selected:
-            if candidate not in existing_ids:
-                session.add(
-                    StockOrderAssignment(
-                        stock_order_id=order.id,
-                        service_point_id=sp_id,
-                        user_id=candidate,
-                    )
-                )
+        removed_ids.extend(a.id for a in assignments if a.user_id not in selected)
+        new_rows.extend(
+            {"stock_order_id": order.id, "service_point_id": sp_id, "user_id": candidate}
+            for candidate in selected
+            if candidate not in existing_ids
+        )
+    _write_assignments(session, order, removed_ids, new_rows)
     update_stock_order_status(order)
     session.commit()
     flash("Assignments updated.", "success")
@@ -202,23 +291,19 @@ def stock_order_take(order_id):
     order = get_stock_order_with_details(order_id)
     if order is None:
         abort(404)
-    target_sp_ids = order_service_point_ids(order) & user_service_point_ids(user)
+    target_sp_ids = accessible_service_point_ids(order, user)
     if not target_sp_ids:
         flash("You are not assigned to any required service point.", "warning")
         return redirect(request.referrer or url_for("stock_orders_dashboard"))
+    new_rows = []
     for sp_id in target_sp_ids:
         assignments = [a for a in order.assignments if a.service_point_id == sp_id]
         if user.id in {a.user_id for a in assignments}:
             continue
         if len(assignments) >= 2:
             continue
-        session.add(
-            StockOrderAssignment(
-                stock_order_id=order.id,
-                service_point_id=sp_id,
-                user_id=user.id,
-            )
-        )
+        new_rows.append({"stock_order_id": order.id, "service_point_id": sp_id, "user_id": user.id})
+    _write_assignments(session, order, [], new_rows)
     update_stock_order_status(order)
     session.commit()
     flash("Order claimed.", "success")
@@ -235,25 +320,34 @@ def stock_order_prepare(order_id):
     if not user or not user.can_prepare_orders:
         flash("Prepare permissions are required.", "warning")
         return redirect(url_for("stock_orders_dashboard"))
-    accessible_sp_ids = order_service_point_ids(order) & user_service_point_ids(user)
+    accessible_sp_ids = accessible_service_point_ids(order, user)
     if not accessible_sp_ids:
         flash("No service point access for this order.", "warning")
         return redirect(url_for("stock_orders_dashboard"))
-    sections = []
-    for sp_id in sorted(accessible_sp_ids):
-        service_point = g.db.query(ServicePoint).get(sp_id)
-        items = [item for item in order.items if item.service_point_id == sp_id]
-        if not items:
+    items_by_sp = defaultdict(list)
+    completed = 0
+    remaining = 0.0
+    # the summary stats are gathered in the same pass that buckets the items
+    for item in order.items:
+        if item.service_point_id not in accessible_sp_ids:
             continue
+        items_by_sp[item.service_point_id].append(item)
+        ordered = item.quantity_ordered
+        prepared = item.quantity_prepared
+        if prepared >= ordered:
+            completed += 1
+        remaining += max((ordered or 0) - (prepared or 0), 0)
+    sections = []
+    for sp_id in sorted(items_by_sp):
+        items = items_by_sp[sp_id]
+        # service points come eager-loaded with the items, so no per-section lookup is needed
         task = ensure_scan_task_for_order(order, sp_id, user)
-        sections.append({"service_point": service_point, "items": items, "scan_task": task})
-    stats = {"items": 0, "completed": 0, "remaining": 0.0}
-    for section in sections:
-        for item in section["items"]:
-            stats["items"] += 1
-            if item.quantity_prepared >= item.quantity_ordered:
-                stats["completed"] += 1
-            stats["remaining"] += item.remaining_to_prepare
+        sections.append({"service_point": items[0].service_point, "items": items, "scan_task": task})
+    stats = {
+        "items": sum(len(items) for items in items_by_sp.values()),
+        "completed": completed,
+        "remaining": remaining,
+    }
     _log_order_context("prepare-view", order)
     return render_template(
         "stock_order_prepare.html",
@@ -266,73 +360,112 @@ def stock_order_prepare(order_id):
     )
 
 
-@orders_bp.post("/stock-orders/<int:order_id>/scan", endpoint="stock_order_scan")
-def stock_order_scan(order_id):
-    session = g.db
-    order = get_stock_order_with_details(order_id)
-    if order is None:
-        abort(404)
-    user = g.current_user
-    if not user or not user.can_prepare_orders:
-        abort(403)
-    payload = request.get_json(silent=True) or request.form
-    if not payload:
-        return jsonify({"success": False, "error": "Missing payload"}), 400
+def _apply_scan(order, user, payload, tasks, events):
+    """Validate and apply one barcode scan to the loaded order.
+
+    Returns (body, status, log_extra). Scan tasks are reused through ``tasks`` and the
+    scan event rows are appended to ``events`` so the caller inserts them in one statement.
+    """
     try:
         service_point_id = int(payload.get("service_point_id"))
     except (TypeError, ValueError):
-        return jsonify({"success": False, "error": "Invalid service point"}), 400
-    if service_point_id not in (order_service_point_ids(order) & user_service_point_ids(user)):
-        return jsonify({"success": False, "error": "Unauthorized service point"}), 403
+        return {"success": False, "error": "Invalid service point"}, 400, None
+    if service_point_id not in accessible_service_point_ids(order, user):
+        return {"success": False, "error": "Unauthorized service point"}, 403, None
     barcode = (payload.get("barcode") or "").strip()
     if not barcode:
-        return jsonify({"success": False, "error": "Missing barcode"}), 400
+        return {"success": False, "error": "Missing barcode"}, 400, None
     qty_raw = payload.get("qty")
     try:
         qty = float(qty_raw) if qty_raw is not None else 1.0
     except (TypeError, ValueError):
         qty = 1.0
     if qty <= 0:
-        return jsonify({"success": False, "error": "Quantity must be positive"}), 400
-    product = find_product_by_barcode(session, barcode)
+        return {"success": False, "error": "Quantity must be positive"}, 400, None
+    product = find_product_by_barcode(g.db, barcode)
     if product is None:
-        return jsonify({"success": False, "error": "Product not found"}), 404
-    order_item = next(
-        (item for item in order.items if item.product_id == product.id and item.service_point_id == service_point_id),
-        None,
-    )
+        return {"success": False, "error": "Product not found"}, 404, None
+    order_item = order_items_by_product(order, service_point_id).get(product.id)
     if order_item is None:
-        return jsonify({"success": False, "error": "Item not part of this order"}), 404
+        return {"success": False, "error": "Item not part of this order"}, 404, None
     if order_item.quantity_prepared + qty > order_item.quantity_ordered:
-        return jsonify({"success": False, "error": "Quantity exceeds order"}), 400
-    task = ensure_scan_task_for_order(order, service_point_id, user)
+        return {"success": False, "error": "Quantity exceeds order"}, 400, None
+    task = tasks.get(service_point_id)
+    if task is None:
+        task = tasks[service_point_id] = ensure_scan_task_for_order(order, service_point_id, user)
     scan_item = next((item for item in task.items if item.product_id == product.id), None)
     if scan_item is None:
-        return jsonify({"success": False, "error": "Task item missing"}), 404
+        return {"success": False, "error": "Task item missing"}, 404, None
     order_item.quantity_prepared += qty
     scan_item.scanned_qty = order_item.quantity_prepared
     update_scan_task_status(task)
     update_stock_order_status(order)
-    record_scan_event(task, scan_item, qty, source="stock_order", message="stock order preparation")
+    events.append(scan_event_values(task, scan_item, qty, source="stock_order", message="stock order preparation"))
+    return _prepared_item_result(order, order_item, product.name), 200, f"barcode={barcode} qty={qty}"
+
+
+@orders_bp.post("/stock-orders/<int:order_id>/scan", endpoint="stock_order_scan")
+def stock_order_scan(order_id):
+    session = g.db
+    order = get_stock_order_with_details(order_id)
+    if order is None:
+        abort(404)
+    user = g.current_user
+    if not user or not user.can_prepare_orders:
+        abort(403)
+    payload = request.get_json(silent=True) or request.form
+    if not payload:
+        return jsonify({"success": False, "error": "Missing payload"}), 400
+    events = []
+    body, status, log_extra = _apply_scan(order, user, payload, {}, events)
+    if status != 200:
+        return jsonify(body), status
+    session.execute(insert(ScanEvent), events)
     session.commit()
-    _log_order_context("scan", order, extra=f"barcode={barcode} qty={qty}")
-    item_data = {
-        "product": product.name,
-        "ordered": order_item.quantity_ordered,
-        "prepared": order_item.quantity_prepared,
-        "delivered": order_item.quantity_delivered,
-        "remaining": order_item.remaining_to_prepare,
-        "status": order_item.preparation_status,
-        "item_id": order_item.id,
+    _log_order_context("scan", order, extra=log_extra)
+    return jsonify(body)
+
+
+@orders_bp.post("/stock-orders/<int:order_id>/scan-batch", endpoint="stock_order_scan_batch")
+def stock_order_scan_batch(order_id):
+    """Apply a burst of scans in one request: {"scans": [{"service_point_id", "barcode", "qty"}, ...]}.
+
+    Each scan is validated like a single scan; rejected ones are reported in ``results``
+    and the accepted ones are committed together.
+    """
+    session = g.db
+    order = get_stock_order_with_details(order_id)
+    if order is None:
+        abort(404)
+    user = g.current_user
+    if not user or not user.can_prepare_orders:
+        abort(403)
+    payload = request.get_json(silent=True)
+    scans = payload.get("scans") if isinstance(payload, dict) else None
+    if not isinstance(scans, list) or not scans:
+        return jsonify({"success": False, "error": "Missing scans"}), 400
+    if len(scans) > SCAN_BATCH_MAX_SIZE:
+        return jsonify({"success": False, "error": f"At most {SCAN_BATCH_MAX_SIZE} scans per batch"}), 400
+    tasks = {}
+    events = []
+    results = []
+    for scan in scans:
+        if not isinstance(scan, dict):
+            results.append({"success": False, "error": "Invalid scan"})
+            continue
+        body, _status, _log_extra = _apply_scan(order, user, scan, tasks, events)
+        results.append(body)
+    response = {
+        "success": len(events) == len(scans),
+        "results": results,
+        "order_status": order.status,
+        "order_status_label": STOCK_ORDER_STATUS_LABELS.get(order.status, order.status),
     }
-    return jsonify(
-        {
-            "success": True,
-            "item": item_data,
-            "order_status": order.status,
-            "order_status_label": STOCK_ORDER_STATUS_LABELS.get(order.status, order.status),
-        }
-    )
+    if events:
+        session.execute(insert(ScanEvent), events)
+        session.commit()
+        _log_order_context("scan-batch", order, extra=f"scans={len(scans)} applied={len(events)}")
+    return jsonify(response)
 
 
 @orders_bp.post("/stock-orders/<int:order_id>/manual", endpoint="stock_order_manual")
@@ -351,7 +484,7 @@ def stock_order_manual(order_id):
         service_point_id = int(payload.get("service_point_id"))
     except (TypeError, ValueError):
         return jsonify({"success": False, "error": "Invalid service point"}), 400
-    if service_point_id not in (order_service_point_ids(order) & user_service_point_ids(user)):
+    if service_point_id not in accessible_service_point_ids(order, user):
         return jsonify({"success": False, "error": "Unauthorized service point"}), 403
     try:
         item_id = int(payload.get("item_id"))
@@ -409,27 +542,12 @@ def stock_order_manual(order_id):
     update_scan_task_status(task)
     update_stock_order_status(order)
     record_scan_event(task, scan_item, abs(delta) if delta is not None else 0.0, source="manual", message="stock order manual entry")
+    result = _prepared_item_result(order, order_item, order_item.product.name if order_item.product else "Unknown")
+    result["item"]["target"] = new_prepared
     g.db.commit()
     log_extra = f"item={order_item.id} delta={delta:.2f}" if delta is not None else f"item={order_item.id}"
     _log_order_context("manual", order, extra=log_extra)
-    item_data = {
-        "item_id": order_item.id,
-        "product": order_item.product.name if order_item.product else "Unknown",
-        "ordered": order_item.quantity_ordered,
-        "prepared": order_item.quantity_prepared,
-        "delivered": order_item.quantity_delivered,
-        "remaining": order_item.remaining_to_prepare,
-        "status": order_item.preparation_status,
-        "target": new_prepared,
-    }
-    return jsonify(
-        {
-            "success": True,
-            "item": item_data,
-            "order_status": order.status,
-            "order_status_label": STOCK_ORDER_STATUS_LABELS.get(order.status, order.status),
-        }
-    )
+    return jsonify(result)
 
 
 @orders_bp.route("/stock-orders/<int:order_id>/handover", methods=["GET", "POST"], endpoint="stock_order_handover")
@@ -498,28 +616,10 @@ def stock_order_handover(order_id):
         
         update_stock_order_status(order)
 
-        update_stock_order_status(order)
-
         if order.status == "delivered":
             order.delivered_at = timestamp
             order.delivered_by_id = user_id
 
-        # --- НАЧАЛО НА КОРЕКЦИЯТА ---
-        # Тъй като сесията не записва статуса надеждно,
-        # ние изрично ѝ казваме да го направи с директна заявка.
-        # Това ще се изпълни в същата транзакция.
-        session.query(StockOrder).filter(StockOrder.id == order.id).update(
-            {
-                "status": order.status,
-                "delivered_at": order.delivered_at,
-                "delivered_by_id": order.delivered_by_id,
-                "last_handover_at": order.last_handover_at,
-                "last_handover_by_id": order.last_handover_by_id,
-            },
-            synchronize_session=False # Важно е да е False тук!
-        )
-        # --- КРАЙ НА КОРЕКЦИЯТА ---
-
 
         # Създаваме и свързваме ППП документа.
         reference_key = order.external_id or str(order.id)
@@ -528,7 +628,8 @@ def stock_order_handover(order_id):
         identifier_suffix = timestamp.strftime("%Y%m%d%H%M%S")
         pdf_identifier = f"{order.id}_{identifier_suffix}_draft"
         signed_pdf_identifier = f"{order.id}_{identifier_suffix}_signed"
-        pdf_url = generate_ppp_pdf(order, identifier=pdf_identifier)
+        # the draft has the same content without the signature, so it is rendered after commit
+        pdf_url = ppp_pdf_reference(order.id, pdf_identifier)
         signed_pdf_url = generate_ppp_pdf(order, signature_rel_path=signature_rel, identifier=signed_pdf_identifier)
 
         document = PPPDocument(
@@ -541,6 +642,7 @@ def stock_order_handover(order_id):
         )
         session.add(document)
         session.commit()
+        enqueue_ppp_draft(current_app._get_current_object(), order.id, pdf_identifier)
 
         flash("Предаването е записано успешно.", "success")
         _log_order_context("handover-complete", order, extra=f"delivered_items={updates} qty={delivered_qty:.2f}")
@@ -577,11 +679,7 @@ def stock_order_ppp(order_id):
     order = get_stock_order_with_details(order_id)
     if order is None:
         abort(404)
-    documents = sorted(
-        order.ppp_documents,
-        key=lambda doc: doc.created_at or doc.id,
-        reverse=True,
-    )
+    documents = order.ppp_documents
     if not documents:
         flash("No PPP document found.", "warning")
         return redirect(url_for("orders.stock_order_handover", order_id=order.id))
@@ -591,10 +689,10 @@ def stock_order_ppp(order_id):
     scan_tasks = (
         session.query(ScanTask)
         .options(
-            joinedload(ScanTask.events)
+            selectinload(ScanTask.events)
             .joinedload(ScanEvent.item)
             .joinedload(ScanTaskItem.product),
-            joinedload(ScanTask.items).joinedload(ScanTaskItem.product),
+            selectinload(ScanTask.items).joinedload(ScanTaskItem.product),
             joinedload(ScanTask.created_by),
         )
         .filter(ScanTask.stock_order_id == order.id)
@@ -615,20 +713,15 @@ def stock_order_ppp(order_id):
 @orders_bp.route("/stock-orders/completed", endpoint="ppp_documents")
 def ppp_documents():
     session = g.db
-    view_mode = request.args.get("view", "cards")
-    if view_mode not in ("cards", "table"):
-        view_mode = "cards"
-    base_args = request.args.to_dict()
-    base_args.pop("view", None)
-    cards_url = url_for("orders.ppp_documents", **{**base_args, "view": "cards"})
-    table_url = url_for("orders.ppp_documents", **{**base_args, "view": "table"})
+    view_mode, cards_url, table_url = view_mode_urls("orders.ppp_documents")
     query = session.query(StockOrder)
     for option in STOCK_ORDER_EAGER_OPTIONS:
         query = query.options(option)
-    orders = (
-        query.filter(StockOrder.ppp_documents.any())
-        .order_by(StockOrder.updated_at.desc())
-        .all()
+    orders, older_url, newest_url = _keyset_page(
+        query.filter(StockOrder.ppp_documents.any()),
+        StockOrder.updated_at,
+        PPP_DOCUMENTS_PAGE_SIZE,
+        "orders.ppp_documents",
     )
     attach_service_point_sections(orders)
     return render_template(
@@ -638,12 +731,14 @@ def ppp_documents():
         view_mode=view_mode,
         cards_url=cards_url,
         table_url=table_url,
+        older_url=older_url,
+        newest_url=newest_url,
     )
 
 
 @orders_bp.route("/stock-orders/<int:order_id>/ppp/pdf", endpoint="stock_order_ppp_pdf")
 def stock_order_ppp_pdf(order_id):
-    order = get_stock_order_with_details(order_id)
+    order = g.db.get(StockOrder, order_id, options=[selectinload(StockOrder.ppp_documents)])
     if order is None:
         abort(404)
     doc_id = request.args.get("doc_id", type=int)
@@ -657,9 +752,17 @@ def stock_order_ppp_pdf(order_id):
     pdf_reference = document.signed_pdf_url or document.pdf_url
     if not pdf_reference:
         abort(404)
-    pdf_path = PPP_STATIC_DIR / Path(pdf_reference).name
-    if not pdf_path.exists():
+    pdf_path = _ensure_ppp_pdf(order.id, document, pdf_reference)
+    if pdf_path is None:
         abort(404)
+    if doc_id == document.id and document.signed_pdf_url:
+        # a signed document addressed by id is never rewritten, so browsers may keep it
+        response = send_file(pdf_path, mimetype="application/pdf", as_attachment=False, max_age=PPP_SIGNED_PDF_MAX_AGE)
+        response.cache_control.public = None
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+        return response
+    # the latest document can change with the next handover, so it is revalidated via ETag/Last-Modified
     return send_file(pdf_path, mimetype="application/pdf", as_attachment=False)
 
 
@@ -1,25 +1,36 @@
+import base64
+import codecs
 import csv
+import json
 import os
-from io import BytesIO, StringIO
-
-from app.blueprints.catalog_sync import BrandRegistry, CategoryRegistry
+import time
+from io import StringIO, TextIOWrapper
+
+from app.blueprints.catalog_sync import (
+    BrandRegistry,
+    CategoryRegistry,
+    bump_catalog_generation,
+    catalog_generation,
+)
 from app.services.art_info_service import ArtInfoService
 from app.services.search_service import ProductSearchService
 from flask import (
     Blueprint,
+    Response,
     abort,
     current_app,
     flash,
     g,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
-    send_file,
+    stream_with_context,
     url_for,
 )
 from flask_login import current_user, login_required
-from sqlalchemy import func, or_
+from sqlalchemy import func, or_, tuple_
 
 from constants import (
     ALLOWED_CSV_MIME_TYPES,
@@ -35,6 +46,7 @@ from models import (
     PricemindSnapshot,
     PricemindSyncLog,
     Product,
+    SyncLog,
 )
 from printer_utils import (
     active_printers_for_warehouse,
@@ -42,16 +54,41 @@ from printer_utils import (
     send_printer_request,
 )
 from utils import (
-    CSV_IMPORT_MAP,
+    build_row_mapper,
     ensure_catalog_fields,
     normalize_header,
-    parse_bool,
-    parse_float,
 )
 
 
 products_bp = Blueprint("products", __name__)
 
+IMPORT_LOOKUP_CHUNK_SIZE = 500
+CSV_SNIFF_BYTES = 4096
+EXPORT_BATCH_SIZE = 1000
+# Filter choices and the category tree are also refreshed on import/sync; the TTL
+# bounds staleness from edits made elsewhere (admin forms, other workers).
+CATALOG_FILTERS_CACHE_SECONDS = 300
+
+_catalog_filters_cache = {"marker": None, "expires_at": 0.0, "brands": [], "main_groups": []}
+_category_tree_cache = {"marker": None, "expires_at": 0.0, "tree": []}
+
+
+def _chunked(values, chunk_size):
+    for idx in range(0, len(values), chunk_size):
+        yield values[idx : idx + chunk_size]
+
+
+def _detect_csv_encoding(head):
+    # utf-8-sig also accepts plain UTF-8; the incremental decoder tolerates a
+    # multi-byte character cut off at the end of the sniffed block.
+    for encoding in ("utf-8-sig", "cp1251"):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(head)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "utf-8"
+
 
 def build_category_tree(categories):
     tree = {}
@@ -141,6 +178,81 @@ def parse_float_arg(value):
 
 
 
+def _catalog_cache_marker(session):
+    last_sync = session.query(func.max(SyncLog.completed_at)).scalar()
+    return catalog_generation(), last_sync
+
+
+def catalog_filter_options(session, marker):
+    """Return the brand and main group filter choices, cached per catalog version."""
+    now = time.monotonic()
+    cache = _catalog_filters_cache
+    if cache["marker"] != marker or now >= cache["expires_at"]:
+        brands = [
+            row[0]
+            for row in session.query(Product.brand)
+            .filter(Product.is_active.is_(True))
+            .filter(Product.brand.isnot(None))
+            .filter(Product.brand != "")
+            .distinct()
+            .order_by(Product.brand)
+        ]
+        group_expr = func.coalesce(Product.primary_group, Product.category)
+        main_groups = [
+            row[0]
+            for row in session.query(group_expr)
+            .filter(Product.is_active.is_(True))
+            .filter(group_expr.isnot(None))
+            .filter(group_expr != "")
+            .distinct()
+            .order_by(group_expr)
+        ]
+        cache.update(
+            marker=marker,
+            expires_at=now + CATALOG_FILTERS_CACHE_SECONDS,
+            brands=brands,
+            main_groups=main_groups,
+        )
+    return cache["brands"], cache["main_groups"]
+
+
+def catalog_nav_tree(session, marker):
+    """Return the category navigation tree for active products, rebuilt only when the catalog changes."""
+    now = time.monotonic()
+    cache = _category_tree_cache
+    if cache["marker"] != marker or now >= cache["expires_at"]:
+        categories = session.query(Category).order_by(Category.level, Category.name).all()
+        active_category_ids = {
+            row[0]
+            for row in session.query(Product.category_id)
+            .filter(Product.is_active.is_(True))
+            .filter(Product.category_id.isnot(None))
+            .distinct()
+        }
+        visible_category_ids = expand_category_ids_with_parents(categories, active_category_ids)
+        cache.update(
+            marker=marker,
+            expires_at=now + CATALOG_FILTERS_CACHE_SECONDS,
+            tree=build_nav_category_tree(categories, allowed_ids=visible_category_ids),
+        )
+    return cache["tree"]
+
+
+def _encode_product_cursor(name, product_id):
+    raw = json.dumps([name, product_id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_product_cursor(token):
+    if not token:
+        return None
+    try:
+        name, product_id = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        return str(name), int(product_id)
+    except (TypeError, ValueError):
+        return None
+
+
 def user_can_view_competitor_prices(user):
     return bool(
         user
@@ -188,8 +300,12 @@ def products():
     if view_mode not in ("cards", "table"):
         view_mode = "cards"
 
-    page = request.args.get("page", 1, type=int)
+    page = max(request.args.get("page", 1, type=int), 1)
     per_page = 30
+    cursor = _decode_product_cursor(request.args.get("cursor"))
+    is_partial = request.headers.get("X-Requested-With") == "XMLHttpRequest" or request.args.get(
+        "partial"
+    )
     search_service = ProductSearchService(current_app)
     use_es = search_service.is_enabled() and any(
         [name_query, item_number, brand_filter, main_group_filter]
@@ -198,6 +314,7 @@ def products():
     current_batch = []
     total_items = 0
     has_more = False
+    next_cursor = None
 
     if use_es:
         search_term = " ".join([value for value in [item_number, name_query] if value]).strip()
@@ -224,74 +341,53 @@ def products():
     if not use_es:
         query = session.query(Product).filter(Product.is_active.is_(True))
         if item_number:
-            query = query.filter(func.lower(Product.item_number).contains(item_number.lower()))
+            query = query.filter(Product.item_number.icontains(item_number, autoescape=True))
         if name_query:
-            query = query.filter(func.lower(Product.name).contains(name_query.lower()))
+            query = query.filter(Product.name.icontains(name_query, autoescape=True))
         if brand_filter:
             query = query.filter(Product.brand == brand_filter)
         if main_group_filter:
             group_expr = func.coalesce(Product.primary_group, Product.category)
             query = query.filter(group_expr == main_group_filter)
-        total_items = query.order_by(None).count()
-        current_batch = (
-            query.order_by(Product.name)
-            .offset((page - 1) * per_page)
-            .limit(per_page)
-            .all()
+        # Load-more follows a (name, id) cursor so deep pages do not scan past an OFFSET;
+        # one extra row tells whether another page exists without counting.
+        batch_query = query.order_by(Product.name, Product.id)
+        if cursor:
+            batch_query = batch_query.filter(tuple_(Product.name, Product.id) > cursor)
+        else:
+            batch_query = batch_query.offset((page - 1) * per_page)
+        rows = batch_query.limit(per_page + 1).all()
+        current_batch = rows[:per_page]
+        has_more = len(rows) > per_page
+        if has_more:
+            next_cursor = _encode_product_cursor(current_batch[-1].name, current_batch[-1].id)
+        if not is_partial:
+            # Count the filtered ids directly instead of wrapping the full row query in a subquery.
+            total_items = query.with_entities(func.count(Product.id)).order_by(None).scalar() or 0
+
+    if is_partial:
+        # Load-more requests only need the rows, not the page chrome.
+        response = make_response(
+            render_template(
+                "products_partial.html",
+                products=current_batch,
+                view_mode=view_mode,
+            )
         )
-        has_more = page * per_page < total_items
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
+
     base_args = request.args.to_dict()
     base_args.pop("page", None)
+    base_args.pop("cursor", None)
     base_args.pop("view", None)
     cards_url = url_for("products.products", **{**base_args, "view": "cards"})
     table_url = url_for("products.products", **{**base_args, "view": "table"})
+    cache_marker = _catalog_cache_marker(session)
+    brands, main_groups = catalog_filter_options(session, cache_marker)
 
-    is_partial = request.headers.get("X-Requested-With") == "XMLHttpRequest" or request.args.get(
-        "partial"
-    )
-    if is_partial:
-        return render_template(
-            "products_partial.html",
-            products=current_batch,
-            view_mode=view_mode,
-        )
-
-    brands = (
-        session.query(Product.brand)
-        .filter(Product.is_active.is_(True))
-        .filter(Product.brand.isnot(None))
-        .filter(Product.brand != "")
-        .distinct()
-        .order_by(Product.brand)
-        .all()
-    )
-    brands = [row[0] for row in brands]
-
-    group_expr = func.coalesce(Product.primary_group, Product.category)
-    main_groups = (
-        session.query(group_expr)
-        .filter(Product.is_active.is_(True))
-        .filter(group_expr.isnot(None))
-        .filter(group_expr != "")
-        .distinct()
-        .order_by(group_expr)
-        .all()
-    )
-    main_groups = [row[0] for row in main_groups]
-
-    categories = session.query(Category).order_by(Category.level, Category.name).all()
-    active_category_ids = {
-        row[0]
-        for row in session.query(Product.category_id)
-        .filter(Product.is_active.is_(True))
-        .filter(Product.category_id.isnot(None))
-        .distinct()
-        .all()
-    }
-    visible_category_ids = expand_category_ids_with_parents(
-        categories, active_category_ids
-    )
-    category_tree = build_nav_category_tree(categories, allowed_ids=visible_category_ids)
+    category_tree = catalog_nav_tree(session, cache_marker)
 
     return render_template(
         "products.html",
@@ -299,6 +395,7 @@ def products():
         total_items=total_items,
         has_more=has_more,
         next_page=page + 1,
+        next_cursor=next_cursor,
         brands=brands,
         main_groups=main_groups,
         view_mode=view_mode,
@@ -387,6 +484,9 @@ def category_page(slug):
 
     page = request.args.get("page", 1, type=int)
     per_page = 30
+    is_partial = request.headers.get("X-Requested-With") == "XMLHttpRequest" or request.args.get(
+        "partial"
+    )
     search_service = ProductSearchService(current_app)
     use_es = search_service.is_enabled() and any(
         [search_query, brand_filter, min_price is not None, max_price is not None]
@@ -428,12 +528,11 @@ def category_page(slug):
             .filter(Product.category_id.in_(category_ids))
         )
         if search_query:
-            like_search = f"%{search_query}%"
             query = query.filter(
                 or_(
-                    Product.name.ilike(like_search),
-                    Product.item_number.ilike(like_search),
-                    Product.brand.ilike(like_search),
+                    Product.name.icontains(search_query, autoescape=True),
+                    Product.item_number.icontains(search_query, autoescape=True),
+                    Product.brand.icontains(search_query, autoescape=True),
                 )
             )
         if brand_filter:
@@ -450,25 +549,17 @@ def category_page(slug):
         else:
             order_clause = Product.id.desc()
 
-        total_items = query.order_by(None).count()
-        current_batch = (
+        rows = (
             query.order_by(order_clause, Product.name)
             .offset((page - 1) * per_page)
-            .limit(per_page)
+            .limit(per_page + 1)
             .all()
         )
-        has_more = page * per_page < total_items
+        current_batch = rows[:per_page]
+        has_more = len(rows) > per_page
+        if not is_partial:
+            total_items = query.with_entities(func.count(Product.id)).order_by(None).scalar() or 0
 
-    base_args = request.args.to_dict()
-    base_args.pop("page", None)
-    base_args.pop("view", None)
-    base_args.pop("partial", None)
-    cards_url = url_for("products.category_page", slug=category.slug, **{**base_args, "view": "cards"})
-    table_url = url_for("products.category_page", slug=category.slug, **{**base_args, "view": "table"})
-
-    is_partial = request.headers.get("X-Requested-With") == "XMLHttpRequest" or request.args.get(
-        "partial"
-    )
     if is_partial:
         return render_template(
             "products_partial.html",
@@ -476,6 +567,13 @@ def category_page(slug):
             view_mode=view_mode,
         )
 
+    base_args = request.args.to_dict()
+    base_args.pop("page", None)
+    base_args.pop("view", None)
+    base_args.pop("partial", None)
+    cards_url = url_for("products.category_page", slug=category.slug, **{**base_args, "view": "cards"})
+    table_url = url_for("products.category_page", slug=category.slug, **{**base_args, "view": "table"})
+
     brands = (
         session.query(Product.brand)
         .filter(Product.category_id.in_(category_ids))
@@ -651,26 +749,22 @@ def import_products():
             )
             return redirect(url_for("products.import_products"))
         file.stream.seek(0)
-        raw = file.read()
-        data = None
-        for encoding in ("utf-8-sig", "utf-8", "cp1251"):
-            try:
-                data = raw.decode(encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        if data is None:
-            data = raw.decode("utf-8", errors="ignore")
-        sample = data[:2048]
+        head = file.stream.read(CSV_SNIFF_BYTES)
+        file.stream.seek(0)
+        encoding = _detect_csv_encoding(head)
+        sample = head.decode(encoding, errors="ignore")[:2048]
         delimiter = ","
         delimiter_candidates = {",": sample.count(","), ";": sample.count(";"), "\t": sample.count("\t")}
         if any(delimiter_candidates.values()):
             delimiter = max(delimiter_candidates, key=delimiter_candidates.get)
-        reader = csv.DictReader(StringIO(data), delimiter=delimiter)
-        if not reader.fieldnames:
+        # Decode while csv reads instead of holding the raw upload and its decoded copy.
+        text_stream = TextIOWrapper(file.stream, encoding=encoding, errors="replace", newline="")
+        reader = csv.reader(text_stream, delimiter=delimiter)
+        fieldnames = next(reader, None)
+        if not fieldnames:
             flash("CSV файлът няма заглавен ред.", "danger")
             return redirect(url_for("products.import_products"))
-        header_map = {normalize_header(name): name for name in reader.fieldnames}
+        header_map = {normalize_header(name): name for name in fieldnames}
         required_cols = {
             normalize_header(name)
             for name in ["Номенклатурен номер", "Наименование", "Мерна единица 1"]
@@ -681,43 +775,82 @@ def import_products():
                 "danger",
             )
             return redirect(url_for("products.import_products"))
-        brand_registry = BrandRegistry(session)
-        category_registry = CategoryRegistry(session)
+        # New brands and categories are inserted together after the file is read,
+        # instead of one flush per unseen name.
+        brand_registry = BrandRegistry(session, deferred=True)
+        category_registry = CategoryRegistry(session, deferred=True)
+        row_mapper = build_row_mapper(fieldnames)
+        entries = []
         for row in reader:
-            payload = {}
-            for normalized_name, header in header_map.items():
-                attr = CSV_IMPORT_MAP.get(normalized_name)
-                if not attr:
-                    continue
-                raw_value = row.get(header)
-                if attr in BOOLEAN_FIELDS:
-                    payload[attr] = parse_bool(raw_value)
-                elif attr in FLOAT_FIELDS:
-                    payload[attr] = parse_float(raw_value)
-                else:
-                    payload[attr] = (raw_value or "").strip() or None
+            if not row:
+                continue
+            row_len = len(row)
+            payload = {
+                attr: parser(row[index] if index < row_len else None)
+                for index, attr, parser in row_mapper
+            }
             item_number = payload.get("item_number")
             name = payload.get("name")
             if not item_number or not name:
                 continue
-            ensure_catalog_fields(payload, brand_registry, category_registry)
+            brand, category = ensure_catalog_fields(payload, brand_registry, category_registry)
             payload["main_unit"] = payload.get("main_unit") or "pcs"
             image_value = payload.get("image_url")
             if not image_value:
                 payload["image_url"] = DEFAULT_PRODUCT_IMAGE
             elif not str(image_value).lower().startswith(("http://", "https://")):
                 payload["image_url"] = image_value.lstrip("/").replace("static/", "")
-            product = session.query(Product).filter_by(item_number=item_number).first()
-            if product:
-                for key, val in payload.items():
-                    setattr(product, key, val)
+            entries.append((payload, brand, category))
+        brand_registry.flush_pending()
+        category_registry.flush_pending()
+        payloads = {}
+        for payload, brand, category in entries:
+            if brand:
+                payload["brand_id"] = brand.id
+            if category:
+                payload["category_id"] = category.id
+            # A repeated item number updates the row created by its first occurrence.
+            if payload["item_number"] in payloads:
                 processed["updated"] += 1
-                changed_item_numbers.add(product.item_number)
-            else:
-                session.add(Product(**payload))
+            payloads[payload["item_number"]] = payload
+
+        columns = set()
+        for payload in payloads.values():
+            columns.update(payload)
+        columns.discard("item_number")
+        compared = [getattr(Product, attr) for attr in sorted(columns)]
+        existing = {}
+        for chunk in _chunked(list(payloads), IMPORT_LOOKUP_CHUNK_SIZE):
+            for row in session.query(Product.id, Product.item_number, *compared).filter(
+                Product.item_number.in_(chunk)
+            ):
+                existing[row.item_number] = row._mapping
+        to_insert = []
+        to_update = []
+        for item_number, payload in payloads.items():
+            current = existing.get(item_number)
+            if current is None:
+                to_insert.append(payload)
                 processed["created"] += 1
                 changed_item_numbers.add(item_number)
+                continue
+            processed["updated"] += 1
+            # Only send (and reindex) rows whose values actually changed.
+            changes = {
+                attr: value
+                for attr, value in payload.items()
+                if attr != "item_number" and current[attr] != value
+            }
+            if changes:
+                changes["id"] = current["id"]
+                to_update.append(changes)
+                changed_item_numbers.add(item_number)
+        if to_update:
+            session.bulk_update_mappings(Product, to_update)
+        if to_insert:
+            session.bulk_insert_mappings(Product, to_insert)
         session.commit()
+        bump_catalog_generation()
         if changed_item_numbers:
             service = ProductSearchService(current_app)
             if service.is_enabled() and service.ensure_index():
@@ -735,39 +868,52 @@ def import_products():
     return render_template("products_import.html")
 
 
+def _product_csv_row(product):
+    row = []
+    for attr, _ in PRODUCT_CSV_FIELDS:
+        value = getattr(product, attr)
+        if attr in BOOLEAN_FIELDS:
+            row.append("1" if value else "0")
+        elif attr in FLOAT_FIELDS:
+            row.append("" if value is None else str(value))
+        elif attr == "image_url":
+            if not value:
+                row.append(DEFAULT_PRODUCT_IMAGE)
+            else:
+                row.append(value.lstrip("/"))
+        else:
+            row.append(value or "")
+    return row
+
+
 @products_bp.route("/products/export")
 @login_required
 def export_products():
     require_admin()
     session = g.db
-    products = session.query(Product).order_by(Product.item_number).all()
-    output = StringIO()
-    writer = csv.writer(output)
-    writer.writerow([header for _, header in PRODUCT_CSV_FIELDS])
-    for product in products:
-        row = []
-        for attr, _ in PRODUCT_CSV_FIELDS:
-            value = getattr(product, attr)
-            if attr in BOOLEAN_FIELDS:
-                row.append("1" if value else "0")
-            elif attr in FLOAT_FIELDS:
-                row.append("" if value is None else str(value))
-            elif attr == "image_url":
-                if not value:
-                    row.append(DEFAULT_PRODUCT_IMAGE)
-                else:
-                    row.append(value.lstrip("/"))
-            else:
-                row.append(value or "")
-        writer.writerow(row)
-    buffer = BytesIO()
-    buffer.write(output.getvalue().encode("utf-8-sig"))
-    buffer.seek(0)
-    return send_file(
-        buffer,
+
+    def generate():
+        # Rows are streamed in batches so the whole catalog never sits in memory as text and bytes.
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow([header for _, header in PRODUCT_CSV_FIELDS])
+        yield output.getvalue().encode("utf-8-sig")
+        output.seek(0)
+        output.truncate()
+        products = session.query(Product).order_by(Product.item_number).yield_per(EXPORT_BATCH_SIZE)
+        for index, product in enumerate(products, start=1):
+            writer.writerow(_product_csv_row(product))
+            if index % EXPORT_BATCH_SIZE == 0:
+                yield output.getvalue().encode("utf-8")
+                output.seek(0)
+                output.truncate()
+        if output.tell():
+            yield output.getvalue().encode("utf-8")
+
+    return Response(
+        stream_with_context(generate()),
         mimetype="text/csv",
-        as_attachment=True,
-        download_name="products_export.csv",
+        headers={"Content-Disposition": "attachment; filename=products_export.csv"},
     )
 
 
@@ -122,13 +122,13 @@ def scan_task_new():
 @scanning_bp.route("/scan-tasks/<int:task_id>", endpoint="scan_task_detail")
 def scan_task_detail(task_id):
     session = g.db
-    task = (
-        session.query(ScanTask)
-        .options(
+    task = session.get(
+        ScanTask,
+        task_id,
+        options=[
             joinedload(ScanTask.items).joinedload(ScanTaskItem.product),
             joinedload(ScanTask.warehouse),
-        )
-        .get(task_id)
+        ],
     )
     if task is None:
         abort(404)
@@ -146,10 +146,10 @@ def scan_task_detail(task_id):
 @scanning_bp.post("/scan-tasks/<int:task_id>/scan", endpoint="scan_task_scan")
 def scan_task_scan(task_id):
     session = g.db
-    task = (
-        session.query(ScanTask)
-        .options(joinedload(ScanTask.items).joinedload(ScanTaskItem.product))
-        .get(task_id)
+    task = session.get(
+        ScanTask,
+        task_id,
+        options=[joinedload(ScanTask.items).joinedload(ScanTaskItem.product)],
     )
     if task is None:
         abort(404)
@@ -230,10 +230,10 @@ def scan_task_events(task_id):
 @scanning_bp.route("/scan-tasks/<int:task_id>/export", endpoint="scan_task_export")
 def scan_task_export(task_id):
     session = g.db
-    task = (
-        session.query(ScanTask)
-        .options(joinedload(ScanTask.items).joinedload(ScanTaskItem.product))
-        .get(task_id)
+    task = session.get(
+        ScanTask,
+        task_id,
+        options=[joinedload(ScanTask.items).joinedload(ScanTaskItem.product)],
     )
     if task is None:
         abort(404)
@@ -260,10 +260,10 @@ def scan_task_export(task_id):
 @scanning_bp.post("/scan-tasks/<int:task_id>/manual", endpoint="scan_task_manual")
 def scan_task_manual(task_id):
     session = g.db
-    task = (
-        session.query(ScanTask)
-        .options(joinedload(ScanTask.items).joinedload(ScanTaskItem.product))
-        .get(task_id)
+    task = session.get(
+        ScanTask,
+        task_id,
+        options=[joinedload(ScanTask.items).joinedload(ScanTaskItem.product)],
     )
     if task is None:
         abort(404)
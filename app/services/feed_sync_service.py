@@ -71,7 +71,18 @@ class ProductFeedSyncService:
                     results[key] = product
         return results
 
-    def _read_feed_rows(self):
+    @classmethod
+    def prefetch_rows(cls, app, executor):
+        """Start downloading the feed on ``executor``; pass the future to ``run_sync``."""
+
+        def _download():
+            with app.app_context():
+                return cls._read_feed_rows()
+
+        return executor.submit(_download)
+
+    @classmethod
+    def _read_feed_rows(cls):
         url = current_app.config.get("FB_FEED_URL")
         if not url:
             raise RuntimeError("FB_FEED_URL is not configured")
@@ -112,7 +123,7 @@ class ProductFeedSyncService:
         reader = csv.DictReader(StringIO(data), delimiter=delimiter)
         if not reader.fieldnames:
             raise RuntimeError("FB feed CSV is missing headers")
-        return [self._normalize_row(row) for row in reader]
+        return [cls._normalize_row(row) for row in reader]
 
     @staticmethod
     def _value_differs(current_value, incoming_value):
@@ -142,7 +153,7 @@ class ProductFeedSyncService:
             if products:
                 service.bulk_index(products)
 
-    def run_sync(self, triggered_by="System"):
+    def run_sync(self, triggered_by="System", rows_future=None):
         session = self.session
         log = SyncLog(
             started_at=datetime.utcnow(),
@@ -153,7 +164,7 @@ class ProductFeedSyncService:
         session.commit()
 
         try:
-            rows = self._read_feed_rows()
+            rows = rows_future.result() if rows_future is not None else self._read_feed_rows()
             total_fetched = len(rows)
             ids = {
                 self._normalize_text(row.get("id"))
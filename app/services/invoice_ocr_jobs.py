@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+from database import SessionLocal
+from models import SupplierInvoice, SupplierInvoiceLine
+
+from app.services.invoice_service import (
+    InvoiceOcrService,
+    build_match_lookup,
+    match_vendor_code,
+    normalize_invoice_payload,
+)
+
+
+OCR_PAGE_LOG_FLUSH_EVERY = 5
+OCR_ACTIVE_STATUSES = ("queued", "processing")
+OCR_INTERRUPTED_MESSAGE = "OCR обработката беше прекъсната при рестарт на сървъра. Качете фактурата отново."
+
+# Dedicated pool so long OCR jobs never take web workers or the shared blocking pool.
+OCR_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("INVOICE_OCR_WORKERS", "2")),
+    thread_name_prefix="invoice-ocr-job",
+)
+
+
+def dumps_payload(value):
+    """Serialize OCR payloads and page logs for the TEXT columns (UTF-8, not ASCII-escaped)."""
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, ensure_ascii=False)
+
+
+def loads_payload(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _process_invoice(app, invoice_id, upload_path):
+    with app.app_context():
+        session = SessionLocal()
+        page_logs = []
+        try:
+            invoice = session.get(SupplierInvoice, invoice_id)
+            if not invoice:
+                return
+            invoice.ocr_status = "processing"
+            session.commit()
+
+            ocr_service = InvoiceOcrService()
+
+            def _append_page_log(page_num, info):
+                entry = {
+                    "page": page_num,
+                    "status": info.get("status"),
+                    "timestamp": datetime.utcnow().isoformat(),
+                }
+                if info.get("status") == "ok":
+                    res = info.get("result") or {}
+                    entry["line_items_count"] = len(res.get("line_items") or [])
+                    entry["usage"] = info.get("usage") or {}
+                else:
+                    entry["error"] = str(info.get("error"))[:1000]
+                page_logs.append(entry)
+                # persist progress every few pages instead of after each one
+                if len(page_logs) % OCR_PAGE_LOG_FLUSH_EVERY == 0:
+                    try:
+                        invoice.ocr_pages_log = dumps_payload(page_logs)
+                        session.commit()
+                    except Exception:
+                        try:
+                            session.rollback()
+                        except Exception:
+                            pass
+                        app.logger.exception("Failed to append OCR page log")
+
+            raw_payload, usage = ocr_service.extract_invoice_data(upload_path, progress_callback=_append_page_log)
+            normalized = normalize_invoice_payload(raw_payload)
+
+            invoice.invoice_number = normalized["header"]["invoice_number"]
+            invoice.issue_date = normalized["header"]["issue_date"]
+            invoice.currency = normalized["header"]["currency"]
+            invoice.vendor_name = normalized["vendor"]["name"]
+            invoice.vendor_vat_id = normalized["vendor"]["vat_id"]
+            invoice.vendor_iban = normalized["vendor"]["iban"]
+            invoice.receiver_name = normalized["receiver"]["name"]
+            invoice.receiver_vat_id = normalized["receiver"]["vat_id"]
+            invoice.net_amount = normalized["totals"]["net_amount"]
+            invoice.vat_amount = normalized["totals"]["vat_amount"]
+            invoice.total_due = normalized["totals"]["total_due"]
+            invoice.ocr_payload = dumps_payload(raw_payload)
+            invoice.ocr_pages_log = dumps_payload(page_logs) if page_logs else None
+            invoice.ocr_status = "success"
+            invoice.error_message = None
+
+            session.query(SupplierInvoiceLine).filter_by(invoice_id=invoice.id).delete()
+            vendor_codes = [item.get("article_no") for item in normalized["line_items"]]
+            lookup = build_match_lookup(session, vendor_codes)
+
+            line_rows = []
+            for idx, item in enumerate(normalized["line_items"], start=1):
+                if not (item.get("article_no") or item.get("description")):
+                    continue
+                product, method = match_vendor_code(item.get("article_no"), lookup)
+                line_rows.append(
+                    {
+                        "invoice_id": invoice.id,
+                        "row_index": idx,
+                        "vendor_code": item.get("article_no"),
+                        "description": item.get("description"),
+                        "quantity": item.get("quantity"),
+                        "unit": item.get("unit"),
+                        "unit_price": item.get("unit_price"),
+                        "total_row": item.get("total_row"),
+                        "matched_product_id": product.id if product else None,
+                        "match_method": method,
+                    }
+                )
+            if line_rows:
+                session.bulk_insert_mappings(SupplierInvoiceLine, line_rows)
+
+            session.commit()
+        except Exception as exc:
+            app.logger.exception("Invoice OCR failed for invoice %s", invoice_id)
+            session.rollback()
+            invoice = session.get(SupplierInvoice, invoice_id)
+            if invoice:
+                invoice.ocr_status = "failed"
+                invoice.error_message = str(exc)[:1000]
+                if page_logs:
+                    invoice.ocr_pages_log = dumps_payload(page_logs)
+                session.commit()
+        finally:
+            session.close()
+
+
+def enqueue_invoice_ocr(app, invoice_id, upload_path):
+    """Run OCR for an uploaded invoice in the background; the detail page polls its status."""
+    return OCR_EXECUTOR.submit(_process_invoice, app, invoice_id, str(upload_path))
+
+
+def fail_stale_invoice_ocr(app):
+    """Mark OCR jobs lost with a previous process as failed so their detail pages stop polling.
+
+    Jobs live only in this process' OCR_EXECUTOR, so a queued or processing invoice
+    that has not been touched for INVOICE_OCR_STALE_MINUTES has no worker left.
+    """
+    stale_minutes = app.config.get("INVOICE_OCR_STALE_MINUTES") or 0
+    if stale_minutes <= 0:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(minutes=stale_minutes)
+    session = SessionLocal()
+    try:
+        updated = (
+            session.query(SupplierInvoice)
+            .filter(
+                SupplierInvoice.ocr_status.in_(OCR_ACTIVE_STATUSES),
+                SupplierInvoice.updated_at < cutoff,
+            )
+            .update(
+                {
+                    SupplierInvoice.ocr_status: "failed",
+                    SupplierInvoice.error_message: OCR_INTERRUPTED_MESSAGE,
+                    SupplierInvoice.updated_at: datetime.utcnow(),
+                },
+                synchronize_session=False,
+            )
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        app.logger.exception("Failed to reset stale invoice OCR jobs")
+        return 0
+    finally:
+        session.close()
+    if updated:
+        app.logger.warning("Marked %s interrupted invoice OCR job(s) as failed", updated)
+    return updated
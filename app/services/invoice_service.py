@@ -1,6 +1,9 @@
 import base64
 import json
 import mimetypes
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -55,6 +58,14 @@ def _coerce_date(value):
     return None
 
 
+class _OcrPageFailed(Exception):
+    """Raised from an OCR worker when a page failed after all fallbacks."""
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
 class InvoiceOcrService:
     def __init__(self, api_key=None, model=None, timeout=None, max_pages=None):
         self.api_key = api_key or current_app.config.get("OPENAI_API_KEY")
@@ -65,11 +76,21 @@ class InvoiceOcrService:
         self.max_pages = max_pages or current_app.config.get("INVOICE_OCR_MAX_PAGES", 15)
         # How many pages to send per request when invoice is multi-page
         self.chunk_pages = int(current_app.config.get("INVOICE_OCR_CHUNK_PAGES", 1))
+        # (path, fitz.Document) opened by _open_pdf and closed when extract_invoice_data returns
+        self._pdf_doc = None
+        # PyMuPDF is not thread-safe; OCR workers re-render pages on retry, so all fitz access goes through this lock.
+        self._pdf_lock = threading.RLock()
 
     def extract_invoice_data(self, file_path: str | Path, progress_callback=None):
         if not self.api_key:
             raise RuntimeError("OPENAI_API_KEY is not configured")
+        # The parsed PDF is shared by the whole run (including page retries) and closed with it.
+        try:
+            return self._extract_invoice_data(file_path, progress_callback)
+        finally:
+            self._close_pdf()
 
+    def _extract_invoice_data(self, file_path: str | Path, progress_callback=None):
         image_payloads, text_payload, source_path = self._build_image_payloads(file_path)
 
         if not image_payloads and not text_payload:
@@ -161,6 +182,21 @@ class InvoiceOcrService:
         else:
             user_content.append({"type": "text", "text": f"Invoice text:\n{text_payload}"})
 
+        # Pages are requested in parallel; space out request starts to stay under the API rate limit
+        min_interval = float(current_app.config.get("INVOICE_OCR_MIN_INTERVAL", 0.5))
+        throttle_lock = threading.Lock()
+        next_slot = [0.0]
+
+        def _throttle():
+            if min_interval <= 0:
+                return
+            with throttle_lock:
+                now = time.monotonic()
+                wait = next_slot[0] - now
+                next_slot[0] = max(now, next_slot[0]) + min_interval
+            if wait > 0:
+                time.sleep(wait)
+
         # Helper to perform a single request with retries
         def _single_request(payload):
             headers = {
@@ -176,12 +212,21 @@ class InvoiceOcrService:
                 try:
                     # explicit tuple (connect_timeout, read_timeout)
                     timeout_tuple = (int(current_app.config.get("INVOICE_OCR_CONNECT_TIMEOUT", 10)), int(self.timeout))
+                    _throttle()
                     resp = session.post(
                         "https://api.openai.com/v1/chat/completions",
                         json=payload,
                         headers=headers,
                         timeout=timeout_tuple,
                     )
+                    if resp.status_code == 429 and attempt < attempts:
+                        # rate limited: honour Retry-After, otherwise back off exponentially
+                        try:
+                            sleep_s = float(resp.headers.get("Retry-After"))
+                        except (TypeError, ValueError):
+                            sleep_s = base_backoff ** attempt
+                        time.sleep(min(sleep_s, 30))
+                        continue
                     if resp.status_code != 200:
                         snippet = (resp.text or "")[:400]
                         raise RuntimeError(f"OCR request failed ({resp.status_code}): {snippet}")
@@ -190,12 +235,7 @@ class InvoiceOcrService:
                     last_exc = exc
                     if attempt < attempts:
                         sleep_s = base_backoff ** attempt
-                        try:
-                            import time
-
-                            time.sleep(sleep_s)
-                        except Exception:
-                            pass
+                        time.sleep(sleep_s)
                         # on next attempt increase read timeout slightly
                         self.timeout = min(int(self.timeout * 1.5), int(current_app.config.get("INVOICE_OCR_MAX_TIMEOUT", 900)))
                         continue
@@ -203,12 +243,7 @@ class InvoiceOcrService:
                     last_exc = exc
                     if attempt < attempts:
                         sleep_s = base_backoff ** attempt
-                        try:
-                            import time
-
-                            time.sleep(sleep_s)
-                        except Exception:
-                            pass
+                        time.sleep(sleep_s)
                         continue
                 except Exception as exc:
                     last_exc = exc
@@ -217,7 +252,7 @@ class InvoiceOcrService:
             # exhausted attempts
             raise last_exc
 
-        # If we have image payloads, process them sequentially (one request per page)
+        # If we have image payloads, process them concurrently (one request per page)
         if image_payloads:
             all_items = []
             header = None
@@ -225,137 +260,156 @@ class InvoiceOcrService:
             totals = {}
             usage_acc = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
             total_images = len(image_payloads)
-            for idx, img_payload in enumerate(image_payloads):
-                # per-page user content: schema + single page
-                page_user_content = [
-                    {"type": "text", "text": f"Extract data to this JSON schema: {json.dumps(schema)}"},
-                    img_payload,
-                ]
-                page_payload = {
-                    "model": self.model,
-                    "temperature": 0,
-                    "response_format": {"type": "json_object"},
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": json.dumps(page_user_content, ensure_ascii=False)},
-                    ],
-                }
+            app = current_app._get_current_object()
+
+            def _ocr_page(idx, img_payload):
+                with app.app_context():
+                    # per-page user content: schema + single page
+                    page_user_content = [
+                        {"type": "text", "text": f"Extract data to this JSON schema: {json.dumps(schema)}"},
+                        img_payload,
+                    ]
+                    page_payload = {
+                        "model": self.model,
+                        "temperature": 0,
+                        "response_format": {"type": "json_object"},
+                        "messages": [
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": json.dumps(page_user_content, ensure_ascii=False)},
+                        ],
+                    }
+                    try:
+                        data = _single_request(page_payload)
+                    except Exception as exc:
+                        # on ReadTimeout or large payload issues, try to re-render this page with lower resolution
+                        if source_path and isinstance(exc, (ReadTimeout, RequestException)):
+                            current_app.logger.warning(
+                                "OCR page %s timed out on first attempt: %s", idx + 1, getattr(exc, "args", exc)
+                            )
+                            data = None
+                            # try progressively smaller zooms
+                            for zoom_try in (0.8, 0.6, 0.5):
+                                try:
+                                    current_app.logger.info("Re-rendering page %s at zoom %s", idx + 1, zoom_try)
+                                    downsampled = self._pdf_to_images_for_pages(source_path, [idx], zoom=zoom_try)
+                                    small_user_content = [
+                                        {"type": "text", "text": f"Extract data to this JSON schema: {json.dumps(schema)}"}
+                                    ] + downsampled
+                                    small_payload = {
+                                        "model": self.model,
+                                        "temperature": 0,
+                                        "response_format": {"type": "json_object"},
+                                        "messages": [
+                                            {"role": "system", "content": system_prompt},
+                                            {"role": "user", "content": json.dumps(small_user_content, ensure_ascii=False)},
+                                        ],
+                                    }
+                                    data = _single_request(small_payload)
+                                    break
+                                except Exception:
+                                    current_app.logger.exception("Retry with zoom %s failed for page %s", zoom_try, idx + 1)
+                                    data = None
+                                    continue
+                            # If downsample retries failed, try JPEG compression fallback if Pillow available
+                            if not data and Image is not None:
+                                try:
+                                    current_app.logger.info("Trying JPEG compression fallback for page %s", idx + 1)
+                                    small_imgs = self._pdf_to_images_for_pages(source_path, [idx], zoom=0.5)
+                                    if small_imgs:
+                                        compressed_payloads = []
+                                        for p in small_imgs:
+                                            data_url = p.get("image_url", {}).get("url")
+                                            if data_url and data_url.startswith("data:"):
+                                                try:
+                                                    header, b64 = data_url.split(",", 1)
+                                                    raw = base64.b64decode(b64)
+                                                    img = Image.open(io.BytesIO(raw)).convert("RGB")
+                                                    out = io.BytesIO()
+                                                    img.save(out, format="JPEG", quality=60, optimize=True)
+                                                    jpg_bytes = out.getvalue()
+                                                    compressed_payloads.append(self._image_payload(jpg_bytes, "image/jpeg"))
+                                                except Exception:
+                                                    current_app.logger.exception("JPEG compression failed for page %s", idx + 1)
+                                                    continue
+                                        if compressed_payloads:
+                                            small_user_content = [
+                                                {"type": "text", "text": f"Extract data to this JSON schema: {json.dumps(schema)}"}
+                                            ] + compressed_payloads
+                                            small_payload = {
+                                                "model": self.model,
+                                                "temperature": 0,
+                                                "response_format": {"type": "json_object"},
+                                                "messages": [
+                                                    {"role": "system", "content": system_prompt},
+                                                    {"role": "user", "content": json.dumps(small_user_content, ensure_ascii=False)},
+                                                ],
+                                            }
+                                            data = _single_request(small_payload)
+                                except Exception:
+                                    current_app.logger.exception("JPEG fallback failed for page %s", idx + 1)
+
+                            if not data:
+                                current_app.logger.error("All retries failed for page %s", idx + 1)
+                                # the callback is notified from the request thread
+                                raise _OcrPageFailed(exc)
+                        else:
+                            raise
+
+                    content = data.get("choices", [{}])[0].get("message", {}).get("content")
+                    if not content:
+                        raise RuntimeError("OCR response did not include content for page")
+                    try:
+                        parsed = json.loads(content)
+                    except json.JSONDecodeError as exc:
+                        raise RuntimeError(f"OCR returned invalid JSON for page: {exc}") from exc
+                    return data, parsed
+
+            workers = min(total_images, max(1, int(current_app.config.get("INVOICE_OCR_CONCURRENCY", 4))))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="invoice-ocr") as pool:
+                futures = [pool.submit(_ocr_page, idx, img_payload) for idx, img_payload in enumerate(image_payloads)]
                 try:
-                    data = _single_request(page_payload)
-                except Exception as exc:
-                    # on ReadTimeout or large payload issues, try to re-render this page with lower resolution
-                    if source_path and isinstance(exc, (ReadTimeout, RequestException)):
-                        current_app.logger.warning(
-                            "OCR page %s timed out on first attempt: %s", idx + 1, getattr(exc, "args", exc)
-                        )
-                        data = None
-                        # try progressively smaller zooms
-                        for zoom_try in (0.8, 0.6, 0.5):
-                            try:
-                                current_app.logger.info("Re-rendering page %s at zoom %s", idx + 1, zoom_try)
-                                downsampled = self._pdf_to_images_for_pages(source_path, [idx], zoom=zoom_try)
-                                small_user_content = [
-                                    {"type": "text", "text": f"Extract data to this JSON schema: {json.dumps(schema)}"}
-                                ] + downsampled
-                                small_payload = {
-                                    "model": self.model,
-                                    "temperature": 0,
-                                    "response_format": {"type": "json_object"},
-                                    "messages": [
-                                        {"role": "system", "content": system_prompt},
-                                        {"role": "user", "content": json.dumps(small_user_content, ensure_ascii=False)},
-                                    ],
-                                }
-                                data = _single_request(small_payload)
-                                break
-                            except Exception:
-                                current_app.logger.exception("Retry with zoom %s failed for page %s", zoom_try, idx + 1)
-                                data = None
-                                continue
-                        # If downsample retries failed, try JPEG compression fallback if Pillow available
-                        if not data and Image is not None:
-                            try:
-                                current_app.logger.info("Trying JPEG compression fallback for page %s", idx + 1)
-                                small_imgs = self._pdf_to_images_for_pages(source_path, [idx], zoom=0.5)
-                                if small_imgs:
-                                    compressed_payloads = []
-                                    for p in small_imgs:
-                                        data_url = p.get("image_url", {}).get("url")
-                                        if data_url and data_url.startswith("data:"):
-                                            try:
-                                                header, b64 = data_url.split(",", 1)
-                                                raw = base64.b64decode(b64)
-                                                img = Image.open(io.BytesIO(raw)).convert("RGB")
-                                                out = io.BytesIO()
-                                                img.save(out, format="JPEG", quality=60, optimize=True)
-                                                jpg_bytes = out.getvalue()
-                                                compressed_payloads.append(self._image_payload(jpg_bytes, "image/jpeg"))
-                                            except Exception:
-                                                current_app.logger.exception("JPEG compression failed for page %s", idx + 1)
-                                                continue
-                                    if compressed_payloads:
-                                        small_user_content = [
-                                            {"type": "text", "text": f"Extract data to this JSON schema: {json.dumps(schema)}"}
-                                        ] + compressed_payloads
-                                        small_payload = {
-                                            "model": self.model,
-                                            "temperature": 0,
-                                            "response_format": {"type": "json_object"},
-                                            "messages": [
-                                                {"role": "system", "content": system_prompt},
-                                                {"role": "user", "content": json.dumps(small_user_content, ensure_ascii=False)},
-                                            ],
-                                        }
-                                        data = _single_request(small_payload)
-                            except Exception:
-                                current_app.logger.exception("JPEG fallback failed for page %s", idx + 1)
-
-                        if not data:
-                            current_app.logger.error("All retries failed for page %s", idx + 1)
+                    # pages are merged in order so line items and callbacks keep the page sequence
+                    for idx, future in enumerate(futures):
+                        try:
+                            data, parsed = future.result()
+                        except _OcrPageFailed as failure:
                             # notify callback about error for this page
                             try:
                                 if progress_callback:
-                                    progress_callback(idx + 1, {"status": "error", "error": str(exc)})
+                                    progress_callback(idx + 1, {"status": "error", "error": str(failure.error)})
                             except Exception:
                                 current_app.logger.exception("progress_callback raised")
-                            raise exc
-                    else:
-                        raise
-
-                content = data.get("choices", [{}])[0].get("message", {}).get("content")
-                if not content:
-                    raise RuntimeError("OCR response did not include content for page")
-                try:
-                    parsed = json.loads(content)
-                except json.JSONDecodeError as exc:
-                    raise RuntimeError(f"OCR returned invalid JSON for page: {exc}") from exc
-
-                # collect header/vendor/totals if present
-                if not header and parsed.get("invoice_header"):
-                    header = parsed.get("invoice_header")
-                if not vendor and parsed.get("vendor"):
-                    vendor = parsed.get("vendor")
-                if parsed.get("line_items"):
-                    # annotate items with source page if helpful
-                    for it in parsed.get("line_items"):
-                        it.setdefault("_source_page", idx + 1)
-                    all_items.extend(parsed.get("line_items"))
-                # accumulate totals if present
-                if parsed.get("totals"):
-                    totals.update({k: parsed.get("totals").get(k) for k in parsed.get("totals")})
-                # accumulate usage if available
-                u = data.get("usage") or {}
-                for k in ("prompt_tokens", "completion_tokens", "total_tokens"):
-                    try:
-                        usage_acc[k] = usage_acc.get(k, 0) + int(u.get(k, 0))
-                    except Exception:
-                        pass
-                # call progress callback with successful page result
-                try:
-                    if progress_callback:
-                        progress_callback(idx + 1, {"status": "ok", "result": parsed, "usage": u})
-                except Exception:
-                    current_app.logger.exception("progress_callback raised")
+                            raise failure.error
+
+                        # collect header/vendor/totals if present
+                        if not header and parsed.get("invoice_header"):
+                            header = parsed.get("invoice_header")
+                        if not vendor and parsed.get("vendor"):
+                            vendor = parsed.get("vendor")
+                        if parsed.get("line_items"):
+                            # annotate items with source page if helpful
+                            for it in parsed.get("line_items"):
+                                it.setdefault("_source_page", idx + 1)
+                            all_items.extend(parsed.get("line_items"))
+                        # accumulate totals if present
+                        if parsed.get("totals"):
+                            totals.update({k: parsed.get("totals").get(k) for k in parsed.get("totals")})
+                        # accumulate usage if available
+                        u = data.get("usage") or {}
+                        for k in ("prompt_tokens", "completion_tokens", "total_tokens"):
+                            try:
+                                usage_acc[k] = usage_acc.get(k, 0) + int(u.get(k, 0))
+                            except Exception:
+                                pass
+                        # call progress callback with successful page result
+                        try:
+                            if progress_callback:
+                                progress_callback(idx + 1, {"status": "ok", "result": parsed, "usage": u})
+                        except Exception:
+                            current_app.logger.exception("progress_callback raised")
+                finally:
+                    for future in futures:
+                        future.cancel()
 
             merged = {
                 "invoice_header": header or {},
@@ -395,8 +449,9 @@ class InvoiceOcrService:
             if fitz is not None:
                 # For multi-page PDFs, prefer lower-res JPEGs to reduce payload size
                 try:
-                    doc = fitz.open(path)
-                    page_count = min(len(doc), int(self.max_pages or 0) or len(doc))
+                    with self._pdf_lock:
+                        doc = self._open_pdf(path)
+                        page_count = min(len(doc), int(self.max_pages or 0) or len(doc))
                 except Exception:
                     doc = None
                     page_count = 0
@@ -413,26 +468,45 @@ class InvoiceOcrService:
         mime = mimetypes.types_map.get(suffix, "image/jpeg")
         return [self._image_payload(path.read_bytes(), mime)], None, None
 
+    def _open_pdf(self, path: Path):
+        """Open a PDF once per extraction run; page retries reuse the parsed document."""
+        path = Path(path)
+        with self._pdf_lock:
+            cached = self._pdf_doc
+            if cached is not None and cached[0] == path:
+                return cached[1]
+            self._close_pdf()
+            doc = fitz.open(path)
+            self._pdf_doc = (path, doc)
+            return doc
+
+    def _close_pdf(self):
+        with self._pdf_lock:
+            cached, self._pdf_doc = self._pdf_doc, None
+            if cached is not None:
+                cached[1].close()
+
     def _pdf_to_images(self, path: Path, zoom: float = 1.0, prefer_jpeg: bool = False, jpeg_quality: int = 75):
         if fitz is None:
             raise RuntimeError("PyMuPDF is required")
         images = []
-        doc = fitz.open(path)
-        page_count = min(len(doc), int(self.max_pages or 0) or len(doc))
-        matrix = fitz.Matrix(zoom, zoom)
-        for idx in range(page_count):
-            page = doc.load_page(idx)
-            pix = page.get_pixmap(matrix=matrix)
-            try:
-                if prefer_jpeg:
-                    # try direct JPEG bytes from PyMuPDF
-                    jpg = pix.tobytes("jpg")
-                    images.append(self._image_payload(jpg, "image/jpeg"))
-                else:
+        with self._pdf_lock:
+            doc = self._open_pdf(path)
+            page_count = min(len(doc), int(self.max_pages or 0) or len(doc))
+            matrix = fitz.Matrix(zoom, zoom)
+            for idx in range(page_count):
+                page = doc.load_page(idx)
+                pix = page.get_pixmap(matrix=matrix)
+                try:
+                    if prefer_jpeg:
+                        # try direct JPEG bytes from PyMuPDF
+                        jpg = pix.tobytes("jpg")
+                        images.append(self._image_payload(jpg, "image/jpeg"))
+                    else:
+                        images.append(self._image_payload(pix.tobytes("png"), "image/png"))
+                except Exception:
+                    # fallback to PNG
                     images.append(self._image_payload(pix.tobytes("png"), "image/png"))
-            except Exception:
-                # fallback to PNG
-                images.append(self._image_payload(pix.tobytes("png"), "image/png"))
         return images
 
     def _pdf_to_images_for_pages(self, path: Path, page_indices: list[int], zoom: float = 1.0, prefer_jpeg: bool = False):
@@ -440,21 +514,22 @@ class InvoiceOcrService:
         if fitz is None:
             raise RuntimeError("PyMuPDF is required")
         images = []
-        doc = fitz.open(path)
-        matrix = fitz.Matrix(zoom, zoom)
-        for idx in page_indices:
-            if idx < 0 or idx >= len(doc):
-                continue
-            page = doc.load_page(idx)
-            pix = page.get_pixmap(matrix=matrix)
-            try:
-                if prefer_jpeg:
-                    jpg = pix.tobytes("jpg")
-                    images.append(self._image_payload(jpg, "image/jpeg"))
-                else:
+        with self._pdf_lock:
+            doc = self._open_pdf(path)
+            matrix = fitz.Matrix(zoom, zoom)
+            for idx in page_indices:
+                if idx < 0 or idx >= len(doc):
+                    continue
+                page = doc.load_page(idx)
+                pix = page.get_pixmap(matrix=matrix)
+                try:
+                    if prefer_jpeg:
+                        jpg = pix.tobytes("jpg")
+                        images.append(self._image_payload(jpg, "image/jpeg"))
+                    else:
+                        images.append(self._image_payload(pix.tobytes("png"), "image/png"))
+                except Exception:
                     images.append(self._image_payload(pix.tobytes("png"), "image/png"))
-            except Exception:
-                images.append(self._image_payload(pix.tobytes("png"), "image/png"))
         return images
 
     def _pdf_to_text(self, path: Path):
@@ -1,14 +1,16 @@
+import time
 from datetime import datetime
 
 from flask import g
 from sqlalchemy import func, select
-from sqlalchemy.orm import joinedload
 
 from constants import (
     STOCK_ORDER_AUTOMATION_STATUSES,
     STOCK_ORDER_EAGER_OPTIONS,
     STOCK_ORDER_STATUSES,
 )
+from database import SessionLocal
+from helpers import BLOCKING_EXECUTOR
 from models import (
     InventoryMovement,
     Product,
@@ -21,6 +23,7 @@ from models import (
     User,
     user_service_points,
 )
+from utils import generate_ppp_pdf
 
 
 def user_service_point_ids(user: User | None):
@@ -38,7 +41,16 @@ def user_service_point_ids(user: User | None):
 
 
 def order_service_point_ids(order: StockOrder):
-    return {item.service_point_id for item in order.items if item.service_point_id}
+    return frozenset(item.service_point_id for item in order.items if item.service_point_id)
+
+
+def accessible_service_point_ids(order: StockOrder, user: User | None):
+    """Service points of the order the user may work on, computed once per request."""
+    cache = g.setdefault("_accessible_service_point_ids", {})
+    key = (order.id, getattr(user, "id", None))
+    if key not in cache:
+        cache[key] = order_service_point_ids(order) & user_service_point_ids(user)
+    return cache[key]
 
 
 def update_stock_order_status(order: StockOrder):
@@ -75,6 +87,15 @@ def update_stock_order_status(order: StockOrder):
     return new_status
 
 
+def order_items_by_product(order: StockOrder, service_point_id: int):
+    """Index the order's items for one service point by product id, keeping the first match."""
+    items_by_product = {}
+    for item in order.items:
+        if item.service_point_id == service_point_id:
+            items_by_product.setdefault(item.product_id, item)
+    return items_by_product
+
+
 def ensure_scan_task_for_order(order: StockOrder, service_point_id: int, user: User | None):
     session = g.db
     task = (
@@ -87,8 +108,8 @@ def ensure_scan_task_for_order(order: StockOrder, service_point_id: int, user: U
         .order_by(ScanTask.id.asc())
         .first()
     )
-    service_point = session.query(ServicePoint).get(service_point_id)
     if task is None:
+        service_point = session.get(ServicePoint, service_point_id)
         task = ScanTask(
             name=f"SO {order.external_id or order.id} - {service_point.name if service_point else service_point_id}",
             type="stock_order_preparation",
@@ -116,15 +137,9 @@ def ensure_scan_task_for_order(order: StockOrder, service_point_id: int, user: U
                 )
             )
     else:
+        items_by_product = order_items_by_product(order, service_point_id)
         for scan_item in task.items:
-            match = next(
-                (
-                    itm
-                    for itm in order.items
-                    if itm.product_id == scan_item.product_id and itm.service_point_id == service_point_id
-                ),
-                None,
-            )
+            match = items_by_product.get(scan_item.product_id)
             if match:
                 scan_item.expected_qty = match.quantity_ordered
                 scan_item.scanned_qty = match.quantity_prepared
@@ -132,21 +147,35 @@ def ensure_scan_task_for_order(order: StockOrder, service_point_id: int, user: U
     return task
 
 
+SERVICE_POINT_CANDIDATES_CACHE_SECONDS = 60
+
+_service_point_candidates_cache = {"expires_at": 0.0, "mapping": {}}
+
+
+def invalidate_service_point_candidates():
+    _service_point_candidates_cache["expires_at"] = 0.0
+
+
 def build_service_point_candidates():
-    session = g.db
-    users = (
-        session.query(User)
-        .options(joinedload(User.service_points))
-        .filter(User.can_prepare_orders.is_(True))
-        .order_by(User.full_name)
-        .all()
-    )
+    """Map service point ids to the (id, full_name) rows of users who can prepare orders there.
+
+    The mapping is shared between requests for a short while; user edits invalidate it.
+    """
+    now = time.monotonic()
+    cache = _service_point_candidates_cache
+    if now < cache["expires_at"]:
+        return cache["mapping"]
+    rows = g.db.execute(
+        select(User.id, User.full_name, user_service_points.c.service_point_id)
+        .join(user_service_points, user_service_points.c.user_id == User.id)
+        .where(User.can_prepare_orders.is_(True))
+        .order_by(User.full_name, User.id)
+    ).all()
     mapping = {}
-    for user in users:
-        for sp in user.service_points:
-            mapping.setdefault(sp.id, []).append(user)
-    for sp_users in mapping.values():
-        sp_users.sort(key=lambda u: u.full_name)
+    for row in rows:
+        mapping.setdefault(row.service_point_id, []).append(row)
+    mapping = {sp_id: tuple(users) for sp_id, users in mapping.items()}
+    cache.update(expires_at=now + SERVICE_POINT_CANDIDATES_CACHE_SECONDS, mapping=mapping)
     return mapping
 
 
@@ -170,10 +199,7 @@ def assignment_load_counts(session):
 
 
 def get_stock_order_with_details(order_id):
-    query = g.db.query(StockOrder)
-    for option in STOCK_ORDER_EAGER_OPTIONS:
-        query = query.options(option)
-    return query.get(order_id)
+    return g.db.get(StockOrder, order_id, options=STOCK_ORDER_EAGER_OPTIONS)
 
 
 def attach_service_point_sections(orders):
@@ -269,16 +295,20 @@ def update_scan_task_status(task: ScanTask):
     task.updated_at = datetime.utcnow()
 
 
+def scan_event_values(task, item, qty, source="scan", message=None, is_error=False):
+    return {
+        "task_id": task.id,
+        "item_id": item.id if item else None,
+        "barcode": item.barcode if item else None,
+        "qty": qty,
+        "source": source,
+        "message": message,
+        "is_error": is_error,
+    }
+
+
 def record_scan_event(task, item, qty, source="scan", message=None, is_error=False):
-    event = ScanEvent(
-        task_id=task.id,
-        item_id=item.id if item else None,
-        barcode=item.barcode if item else None,
-        qty=qty,
-        source=source,
-        message=message,
-        is_error=is_error,
-    )
+    event = ScanEvent(**scan_event_values(task, item, qty, source=source, message=message, is_error=is_error))
     g.db.add(event)
     return event
 
@@ -303,3 +333,21 @@ def apply_inventory_movement(task, item, qty):
         movement_type=task.type,
     )
     g.db.add(movement)
+
+
+def _render_ppp_draft(app, order_id, identifier):
+    with app.app_context():
+        session = SessionLocal()
+        try:
+            order = session.get(StockOrder, order_id, options=STOCK_ORDER_EAGER_OPTIONS)
+            if order is not None:
+                generate_ppp_pdf(order, identifier=identifier)
+        except Exception:
+            app.logger.exception("Failed to render PPP draft for order %s", order_id)
+        finally:
+            session.close()
+
+
+def enqueue_ppp_draft(app, order_id, identifier):
+    """Render the unsigned PPP copy in the background; handover only waits for the signed one."""
+    return BLOCKING_EXECUTOR.submit(_render_ppp_draft, app, order_id, identifier)
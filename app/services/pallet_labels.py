@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+from PIL import Image
+
+try:
+    import segno
+except ImportError:  # pragma: no cover - optional dependency
+    segno = None
+
+from reportlab.lib.pagesizes import A6, landscape
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from sqlalchemy.orm import joinedload, selectinload
+
+from constants import PALLET_LABEL_DIR, PDF_FONT_NAME
+from database import SessionLocal
+from helpers import BLOCKING_EXECUTOR
+from models import ProductList, ProductListItem
+from utils import calculate_list_totals
+
+
+# Pallet label geometry is fixed, so it is computed once rather than per request.
+LABEL_PAGE_SIZE = landscape(A6)
+LABEL_TEXT_X = 15 * mm
+LABEL_QR_BOX = (LABEL_PAGE_SIZE[0] - 70 * mm, LABEL_PAGE_SIZE[1] - 95 * mm, 50 * mm, 50 * mm)
+# Bump when the drawing code changes so stored labels are not reused.
+LABEL_LAYOUT_VERSION = 1
+
+
+@lru_cache(maxsize=1024)
+def _qr_label_image(payload: str):
+    # One pixel per module, handed to ReportLab as a PIL image so no PNG is encoded or decoded per label.
+    if segno is not None:
+        rows = list(segno.make_qr(payload, error="m", boost_error=False).matrix_iter(border=4))
+        image = Image.new("1", (len(rows), len(rows)))
+        image.putdata([0 if dark else 255 for row in rows for dark in row])
+        return image
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=1, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.make_image().get_image()
+
+
+def pallet_label_options():
+    return [
+        joinedload(ProductList.current_warehouse),
+        joinedload(ProductList.target_warehouse),
+        selectinload(ProductList.items).selectinload(ProductListItem.product),
+    ]
+
+
+def _label_lines(product_list):
+    totals = calculate_list_totals(product_list)
+    lines = [
+        (16, 20, product_list.title),
+        (12, 30, f"Code: {product_list.code}"),
+    ]
+    if product_list.pallet_code:
+        lines.append((12, 38, f"Pallet: {product_list.pallet_code}"))
+    lines += [
+        (12, 48, f"From: {product_list.current_warehouse.name}"),
+        (12, 56, f"To: {product_list.target_warehouse.name if product_list.target_warehouse else 'N/A'}"),
+        (12, 66, f"Status: {product_list.status.upper()}"),
+        (12, 74, f"Location: {product_list.storage_location or 'No location provided'}"),
+        (12, 82, f"Items: {totals['total_quantity']:.2f} ({totals['line_count']} rows)"),
+        (12, 90, f"Weight: {totals['total_weight']:.2f} kg"),
+        (12, 98, f"Volume: {totals['total_volume']:.3f} m³"),
+    ]
+    return lines
+
+
+def _render_label(lines, qr_payload) -> bytes:
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=LABEL_PAGE_SIZE)
+    # one text object for all lines; fonts are registered once in constants at import
+    text = pdf.beginText()
+    for font_size, offset_mm, value in lines:
+        text.setFont(PDF_FONT_NAME, font_size)
+        text.setTextOrigin(LABEL_TEXT_X, LABEL_PAGE_SIZE[1] - offset_mm * mm)
+        text.textOut(value)
+    pdf.drawText(text)
+    pdf.drawImage(ImageReader(_qr_label_image(qr_payload)), *LABEL_QR_BOX)
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def pallet_label_file(product_list):
+    """Return the stored label PDF for the list, rendering it first if its content changed.
+
+    Files are named after a digest of everything printed on the label, so edits to the
+    list, its items or their products always produce a new file instead of a stale one.
+    """
+    lines = _label_lines(product_list)
+    qr_payload = product_list.pallet_code or product_list.code
+    digest = hashlib.sha1(repr((LABEL_LAYOUT_VERSION, lines, qr_payload)).encode("utf-8")).hexdigest()[:16]
+    label_path = PALLET_LABEL_DIR / f"{product_list.id}-{digest}.pdf"
+    if label_path.exists():
+        return label_path
+    PALLET_LABEL_DIR.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=PALLET_LABEL_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(_render_label(lines, qr_payload))
+    os.replace(tmp_name, label_path)
+    for stale in PALLET_LABEL_DIR.glob(f"{product_list.id}-*.pdf"):
+        if stale != label_path:
+            stale.unlink(missing_ok=True)
+    return label_path
+
+
+def _prerender_pallet_label(app, list_id):
+    with app.app_context():
+        session = SessionLocal()
+        try:
+            product_list = session.get(ProductList, list_id, options=pallet_label_options())
+            if product_list is not None:
+                pallet_label_file(product_list)
+        except Exception:
+            app.logger.exception("Failed to pre-render pallet label for list %s", list_id)
+        finally:
+            session.close()
+
+
+def enqueue_pallet_label(app, list_id):
+    """Render the list's label in the background so the label route only has to send a file."""
+    return BLOCKING_EXECUTOR.submit(_prerender_pallet_label, app, list_id)
@@ -4,7 +4,7 @@ from pathlib import Path
 
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 
 from models import (
     StockOrder,
@@ -34,6 +34,7 @@ else:
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 PPP_STATIC_DIR = STATIC_DIR / "ppp"
+PALLET_LABEL_DIR = STATIC_DIR / "labels"
 IMAGES_DIR = STATIC_DIR / "images"
 PLACEHOLDER_IMAGE_URL = "https://internal.gstroy.bg/static/assets/images/StroiMarket_no_image.png"
 PLACEHOLDER_IMAGE_PATH = IMAGES_DIR / "no_image.png"
@@ -158,12 +159,14 @@ STOCK_ORDER_TYPE_LABELS = {
     "C": "Вид C"
 }
 
+# Collections are selectin-loaded so the order row is not repeated per item x assignment x document;
+# many-to-one legs stay joined.
 STOCK_ORDER_EAGER_OPTIONS = [
-    joinedload(StockOrder.items).joinedload(StockOrderItem.product),
-    joinedload(StockOrder.items).joinedload(StockOrderItem.service_point),
-    joinedload(StockOrder.assignments).joinedload(StockOrderAssignment.user),
-    joinedload(StockOrder.assignments).joinedload(StockOrderAssignment.service_point),
-    joinedload(StockOrder.ppp_documents),
+    selectinload(StockOrder.items).joinedload(StockOrderItem.product),
+    selectinload(StockOrder.items).joinedload(StockOrderItem.service_point),
+    selectinload(StockOrder.assignments).joinedload(StockOrderAssignment.user),
+    selectinload(StockOrder.assignments).joinedload(StockOrderAssignment.service_point),
+    selectinload(StockOrder.ppp_documents),
     joinedload(StockOrder.warehouse),
 ]
 STATUS_BADGE_CLASSES = {
@@ -27,6 +27,8 @@ from models import (
 
 DATABASE_URL = os.environ.get("ERP_DEMO_DATABASE_URL", "sqlite:///erp_demo.db")
 DEFAULT_USER_PASSWORD = os.environ.get("ERP_DEMO_DEFAULT_PASSWORD", "demo1234")
+# Werkzeug hash method spec, e.g. "scrypt:16384:8:1" or "pbkdf2:sha256:260000".
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
 
 engine = create_engine(
     DATABASE_URL,
@@ -36,7 +38,7 @@ SessionLocal = scoped_session(sessionmaker(bind=engine))
 
 
 def _default_password_hash():
-    return generate_password_hash(DEFAULT_USER_PASSWORD)
+    return generate_password_hash(DEFAULT_USER_PASSWORD, method=PASSWORD_HASH_METHOD)
 
 
 def ensure_column(table: str, column: str, ddl: str):
@@ -48,6 +50,20 @@ def ensure_column(table: str, column: str, ddl: str):
             connection.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
 
 
+def ensure_indexes():
+    """Create model indexes that are missing on tables created before them."""
+    # PRAGMA index_list also reports expression indexes, which SQLAlchemy's
+    # reflection (and therefore checkfirst=True) skips.
+    with engine.connect() as connection:
+        for table in Base.metadata.sorted_tables:
+            result = connection.exec_driver_sql(f'PRAGMA index_list("{table.name}")')
+            existing = {row[1] for row in result.fetchall()}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=connection)
+        connection.commit()
+
+
 def upsert_product(session, data: dict):
     product = session.query(Product).filter_by(item_number=data["item_number"]).first()
     if product:
@@ -128,6 +144,7 @@ def init_db():
     ensure_column("stock_orders", "delivered_by_id", "INTEGER")
     # OCR pages log (stores per-page OCR status JSON)
     ensure_column("supplier_invoices", "ocr_pages_log", "TEXT")
+    ensure_indexes()
 
     session = SessionLocal()
 
@@ -1,7 +1,46 @@
+from flask.json.provider import DefaultJSONProvider
 from flask_login import LoginManager
 from flask_wtf import CSRFProtect
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
 csrf = CSRFProtect()
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
 login_manager.login_message_category = "warning"
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Encode JSON with orjson when it is installed.
+
+    Dates, decimals and other non-native types still go through Flask's
+    ``default`` hook, so the output matches the stdlib provider. Pretty
+    printing and unusual ``json.dumps`` arguments fall back to the stdlib.
+    """
+
+    _FAST_ARGS = {"default", "ensure_ascii", "sort_keys", "separators"}
+
+    def _options(self, sort_keys):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or not self._FAST_ARGS.issuperset(kwargs):
+            return super().dumps(obj, **kwargs)
+        option = self._options(kwargs.get("sort_keys", self.sort_keys))
+        default = kwargs.get("default", self.default)
+        return orjson.dumps(obj, default=default, option=option).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        option = self._options(self.sort_keys) | orjson.OPT_APPEND_NEWLINE
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype
+        )
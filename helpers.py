@@ -1,9 +1,13 @@
+import os
 import re
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-from flask import abort, g, request, url_for
+from flask import abort, current_app, g, request, url_for
+from werkzeug.security import generate_password_hash
 from models import Warehouse
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urlencode, urljoin, urlparse
  
 
 
@@ -23,12 +27,26 @@ def parse_float(value):
         return None
 
 
+# Shared pool for slow network probes and background renders so they can run
+# in parallel and be bounded with a timeout.
+BLOCKING_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BLOCKING_EXECUTOR_WORKERS", "8")),
+    thread_name_prefix="gstroy-blocking",
+)
+
+
+def hash_password(password: str) -> str:
+    method = current_app.config.get("PASSWORD_HASH_METHOD") or "scrypt"
+    return generate_password_hash(password, method=method)
+
+
 def require_admin():
     user = getattr(g, "current_user", None)
     if not user or not getattr(user, "is_admin", False):
         abort(403)
 
 
+@lru_cache(maxsize=4096)
 def slugify(value: str) -> str:
     value = str(value or "")
     normalized = unicodedata.normalize("NFKD", value)
@@ -44,16 +62,15 @@ def hierarchical_address(slug: str, parent_address: str | None) -> str:
 
 
 def unique_slug(session, model, base_slug: str, exclude_id: int | None = None) -> str:
-    slug_candidate = base_slug
-    counter = 1
     slug_field = getattr(model, "slug")
     id_field = getattr(model, "id")
-    while True:
-        query = session.query(model).filter(slug_field == slug_candidate)
-        if exclude_id is not None:
-            query = query.filter(id_field != exclude_id)
-        if not query.first():
-            break
+    query = session.query(slug_field).filter(slug_field.startswith(base_slug, autoescape=True))
+    if exclude_id is not None:
+        query = query.filter(id_field != exclude_id)
+    taken = {row[0] for row in query}
+    slug_candidate = base_slug
+    counter = 1
+    while slug_candidate in taken:
         counter += 1
         slug_candidate = f"{base_slug}-{counter}"
     return slug_candidate
@@ -76,6 +93,23 @@ def safe_redirect_target(target: str | None):
     return url_for("main.index")
 
 
+# Characters werkzeug leaves unescaped in query strings built by url_for.
+QUERY_URL_SAFE_CHARS = "!$'()*,/:;?@"
+
+
+def view_mode_urls(endpoint):
+    """Return the requested index view and the cards/table toggle URLs, keeping the other query args."""
+    view_mode = request.args.get("view", "cards")
+    if view_mode not in ("cards", "table"):
+        view_mode = "cards"
+    # resolve the route once and append both query strings the way url_for would encode them
+    base_url = url_for(endpoint)
+    query = [(key, value) for key, value in request.args.items(multi=True) if key != "view"]
+    cards_url = f"{base_url}?{urlencode(query + [('view', 'cards')], safe=QUERY_URL_SAFE_CHARS)}"
+    table_url = f"{base_url}?{urlencode(query + [('view', 'table')], safe=QUERY_URL_SAFE_CHARS)}"
+    return view_mode, cards_url, table_url
+
+
 def user_warehouse(user):
     if not user:
         return None
@@ -183,6 +217,8 @@ for canonical_name, aliases in UNIT_ALIASES.items():
             UNIT_ALIAS_LOOKUP[token] = canonical_name
 
 
+# Unit labels come from a small fixed vocabulary, so the token parsing is memoized.
+@lru_cache(maxsize=256)
 def canonical_unit_name(value: str | None) -> str | None:
     token = _unit_token(value)
     if not token:
@@ -7,12 +7,14 @@ from sqlalchemy import (
     DateTime,
     Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Table,
     UniqueConstraint,
     Text,
     Time,
+    func,
 )
 from sqlalchemy.orm import declarative_base, relationship
 from flask_login import UserMixin
@@ -140,6 +142,7 @@ class AccessWindow(Base):
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (Index("ix_products_name_id", "name", "id"),)
 
     id = Column(Integer, primary_key=True)
     item_number = Column(String(64), unique=True, nullable=False)
@@ -209,6 +212,16 @@ class Product(Base):
     pricemind_snapshots = relationship("PricemindSnapshot", back_populates="product")
 
 
+# Expression indexes backing the case-insensitive scanner lookups.
+Index("ix_products_barcode_upper", func.upper(Product.barcode))
+Index("ix_products_item_number_upper", func.upper(Product.item_number))
+# Invoice line matching looks vendor codes up by lower() on these columns.
+Index("ix_products_catalog_number_lower", func.lower(Product.catalog_number))
+Index("ix_products_item_number_lower", func.lower(Product.item_number))
+Index("ix_products_barcode_lower", func.lower(Product.barcode))
+Index("ix_products_versus_id", Product.versus_id)
+
+
 class MasterProduct(Base):
     __tablename__ = "master_products"
 
@@ -223,6 +236,9 @@ class MasterProduct(Base):
     last_updated = Column(DateTime, default=datetime.utcnow, nullable=False, onupdate=datetime.utcnow)
 
 
+Index("ix_master_products_vendor_code_lower", func.lower(MasterProduct.vendor_code))
+
+
 class SyncLog(Base):
     __tablename__ = "sync_logs"
 
@@ -260,6 +276,7 @@ class PricemindSyncLog(Base):
 
 class PricemindSnapshot(Base):
     __tablename__ = "pricemind_snapshots"
+    __table_args__ = (Index("ix_pricemind_snapshots_sync_log_id_id", "sync_log_id", "id"),)
 
     id = Column(Integer, primary_key=True)
     sync_log_id = Column(Integer, ForeignKey("pricemind_sync_logs.id"), nullable=False)
@@ -343,6 +360,9 @@ class SupplierInvoice(Base):
 
 class SupplierInvoiceLine(Base):
     __tablename__ = "supplier_invoice_lines"
+    __table_args__ = (
+        Index("ix_supplier_invoice_lines_invoice_id_matched_product_id", "invoice_id", "matched_product_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     invoice_id = Column(Integer, ForeignKey("supplier_invoices.id"), nullable=False)
@@ -471,6 +491,11 @@ class ProductList(Base):
     created_by = relationship("User", back_populates="authored_lists")
 
 
+# Expression indexes backing the case-insensitive receive scan by list or pallet code.
+Index("ix_product_lists_code_upper", func.upper(ProductList.code))
+Index("ix_product_lists_pallet_code_upper", func.upper(ProductList.pallet_code))
+
+
 class ProductListItem(Base):
     __tablename__ = "product_list_items"
 
@@ -653,8 +678,16 @@ class User(UserMixin, Base):
     content_progress = relationship("UserContentProgress", back_populates="user", cascade="all, delete-orphan")
 
 
+Index("ix_users_username_lower", func.lower(User.username))
+
+
 class StockOrder(Base):
     __tablename__ = "stock_orders"
+    __table_args__ = (
+        Index("ix_stock_orders_status_created_at", "status", "created_at"),
+        Index("ix_stock_orders_created_at_id", "created_at", "id"),
+        Index("ix_stock_orders_updated_at_id", "updated_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     external_id = Column(String(64))
@@ -684,7 +717,12 @@ class StockOrder(Base):
     items = relationship("StockOrderItem", back_populates="stock_order", cascade="all, delete-orphan")
     assignments = relationship("StockOrderAssignment", back_populates="stock_order", cascade="all, delete-orphan")
     scan_tasks = relationship("ScanTask", back_populates="stock_order")
-    ppp_documents = relationship("PPPDocument", back_populates="stock_order", cascade="all, delete-orphan")
+    ppp_documents = relationship(
+        "PPPDocument",
+        back_populates="stock_order",
+        cascade="all, delete-orphan",
+        order_by="[desc(PPPDocument.created_at), desc(PPPDocument.id)]",
+    )
 
     @property
     def latest_ppp_document(self):
@@ -709,6 +747,11 @@ class StockOrder(Base):
 
 class StockOrderItem(Base):
     __tablename__ = "stock_order_items"
+    # Serves the per-order item load and (order, service point, product) lookups.
+    # Not unique: nothing stops an order from listing a product twice for a service point.
+    __table_args__ = (
+        Index("ix_stock_order_items_order_sp_product", "stock_order_id", "service_point_id", "product_id"),
+    )
 
     id = Column(Integer, primary_key=True)
     stock_order_id = Column(Integer, ForeignKey("stock_orders.id"), nullable=False)
@@ -1,7 +1,9 @@
 import base64
+import os
 import re
 import secrets
 from datetime import datetime
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
 
@@ -9,6 +11,7 @@ from app.blueprints.catalog_sync import BrandRegistry, CategoryRegistry, extract
 from flask import current_app, g
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
+from sqlalchemy import case, func
 
 from constants import (
     BOOLEAN_FIELDS,
@@ -18,26 +21,25 @@ from constants import (
     PPP_STATIC_DIR,
     UNIT_ALIASES,
 )
-from models import ProductList, StockOrder, TransferDocument, Warehouse
+from models import Product, ProductList, ProductListItem, StockOrder, TransferDocument, Warehouse
+
+
+_HEADER_TRANSLATION = str.maketrans({'"': None, "-": "_", "/": "_"})
+# Two spaces collapse into one underscore, matching the old replace("  ", " ").replace(" ", "_") chain.
+_HEADER_SPACES_RE = re.compile(" {1,2}")
 
 
 def normalize_header(name: str) -> str:
-    return (
-        (name or "")
-        .strip()
-        .lower()
-        .replace("¢??", "")
-        .replace("¢??", "")
-        .replace("¢??", "")
-        .replace('"', "")
-        .replace("-", "_")
-        .replace("/", "_")
-        .replace("  ", " ")
-        .replace(" ", "_")
-    )
+    value = (name or "").strip().lower().replace("¢??", "")
+    return _HEADER_SPACES_RE.sub("_", value.translate(_HEADER_TRANSLATION))
 
 
 def ensure_catalog_fields(payload, brand_registry, category_registry):
+    """Fill brand/category fields in ``payload`` and return the resolved (brand, category).
+
+    With deferred registries new rows have no id yet; callers set ``brand_id`` and
+    ``category_id`` from the returned objects after ``flush_pending()``.
+    """
     brand = brand_registry.ensure(payload.get("brand"))
     if brand:
         payload["brand_id"] = brand.id
@@ -48,6 +50,7 @@ def ensure_catalog_fields(payload, brand_registry, category_registry):
         payload["category_id"] = category.id
         if not payload.get("category"):
             payload["category"] = category.full_address
+    return brand, category
 
 
 def parse_bool(value):
@@ -92,13 +95,18 @@ def ensure_ppp_dir():
     PPP_STATIC_DIR.mkdir(parents=True, exist_ok=True)
 
 
+def ppp_pdf_reference(order_id: int, identifier: str | int) -> str:
+    return f"ppp/ppp_order_{order_id}_{identifier}.pdf"
+
+
 def generate_ppp_pdf(order: StockOrder, signature_rel_path: str | None = None, identifier: str | int | None = None):
     ensure_ppp_dir()
     if identifier is None:
         identifier = int(datetime.utcnow().timestamp())
-    pdf_filename = f"ppp_order_{order.id}_{identifier}.pdf"
-    pdf_path = PPP_STATIC_DIR / pdf_filename
-    pdf = canvas.Canvas(str(pdf_path), pagesize=A4)
+    pdf_reference = ppp_pdf_reference(order.id, identifier)
+    pdf_path = PPP_STATIC_DIR / Path(pdf_reference).name
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
     pdf.setFont(PDF_FONT_NAME, 16)
     pdf.drawString(30, height - 40, "ППП документ")
@@ -148,7 +156,11 @@ def generate_ppp_pdf(order: StockOrder, signature_rel_path: str | None = None, i
     else:
         pdf.line(30, signature_y + 5, 220, signature_y + 5)
     pdf.save()
-    return f"ppp/{pdf_filename}"
+    # readers (the PDF route, a concurrent draft render) never see a half-written file
+    tmp_path = pdf_path.with_name(f"{pdf_path.name}.{secrets.token_hex(4)}.tmp")
+    tmp_path.write_bytes(buffer.getvalue())
+    os.replace(tmp_path, pdf_path)
+    return pdf_reference
 
 
 def save_signature_image(order_id: int, data_url: str):
@@ -181,6 +193,8 @@ def _unit_token(value: str | None) -> str | None:
     return re.sub(r"[\s\.\-/_]", "", normalized or "").lower()
 
 
+# Unit labels come from a small fixed vocabulary, so the token parsing is memoized.
+@lru_cache(maxsize=256)
 def canonical_unit_name(value: str | None) -> str | None:
     token = _unit_token(value)
     if not token:
@@ -258,7 +272,7 @@ def calculate_list_totals(product_list):
         canonical_unit = canonical_unit_name(item.unit)
         if canonical_unit == "pieces":
             total_pieces += qty
-        elif canonical_unit == "package":
+        elif canonical_unit == "packages":
             total_packages += qty
         if product:
             if product.weight_kg:
@@ -278,6 +292,62 @@ def calculate_list_totals(product_list):
     }
 
 
+def bulk_list_totals(session, list_ids):
+    """Same figures as calculate_list_totals for many lists, aggregated in SQL per list and unit."""
+    list_ids = list(list_ids)
+    totals = {
+        list_id: {
+            "line_count": 0,
+            "total_quantity": 0.0,
+            "total_weight": 0.0,
+            "total_volume": 0.0,
+            "total_pieces": 0.0,
+            "total_packages": 0.0,
+        }
+        for list_id in list_ids
+    }
+    if not list_ids:
+        return totals
+    qty = func.coalesce(ProductListItem.quantity, 0.0)
+    has_dimensions = (
+        (func.coalesce(Product.width_cm, 0) != 0)
+        & (func.coalesce(Product.height_cm, 0) != 0)
+        & (func.coalesce(Product.depth_cm, 0) != 0)
+    )
+    volume = case(
+        (
+            has_dimensions,
+            (Product.width_cm / 100.0) * (Product.height_cm / 100.0) * (Product.depth_cm / 100.0) * qty,
+        ),
+        else_=0.0,
+    )
+    rows = (
+        session.query(
+            ProductListItem.list_id,
+            ProductListItem.unit,
+            func.count(ProductListItem.id),
+            func.sum(qty),
+            func.sum(func.coalesce(Product.weight_kg, 0.0) * qty),
+            func.sum(volume),
+        )
+        .outerjoin(Product, Product.id == ProductListItem.product_id)
+        .filter(ProductListItem.list_id.in_(list_ids))
+        .group_by(ProductListItem.list_id, ProductListItem.unit)
+    )
+    for list_id, unit, line_count, quantity, weight, volume_total in rows:
+        entry = totals[list_id]
+        entry["line_count"] += line_count
+        entry["total_quantity"] += quantity or 0.0
+        entry["total_weight"] += weight or 0.0
+        entry["total_volume"] += volume_total or 0.0
+        canonical_unit = canonical_unit_name(unit)
+        if canonical_unit == "pieces":
+            entry["total_pieces"] += quantity or 0.0
+        elif canonical_unit == "packages":
+            entry["total_packages"] += quantity or 0.0
+    return totals
+
+
 def parse_scan_task_lines(raw_text: str):
     pattern = re.compile(r"[;\\s]+")
     entries = []
@@ -315,3 +385,24 @@ CSV_IMPORT_MAP.update(
         "brand": "brand",
     }
 )
+
+
+def _parse_text(value):
+    return (value or "").strip() or None
+
+
+def build_row_mapper(csv_headers):
+    """Resolve a CSV header row once into ``(column index, attribute, parser)`` triples."""
+    mapper = []
+    for index, header in enumerate(csv_headers):
+        attr = CSV_IMPORT_MAP.get(normalize_header(header))
+        if not attr:
+            continue
+        if attr in BOOLEAN_FIELDS:
+            parser = parse_bool
+        elif attr in FLOAT_FIELDS:
+            parser = parse_float
+        else:
+            parser = _parse_text
+        mapper.append((index, attr, parser))
+    return mapper